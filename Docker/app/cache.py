@@ -0,0 +1,166 @@
+import os
+import time
+import pickle
+import logging
+import threading
+import functools
+from collections import OrderedDict
+from urllib.parse import urlencode
+from flask import request, current_app, make_response
+
+# Read-through cache of query results and JSON responses. Entries carry tags naming the
+# data they were computed from; invalidating a tag bumps its generation, which is part of
+# every key, so stale entries are never read again and simply age out of the LRU.
+#   photos  - photo rows (indexer commits)
+#   albums  - albums and their membership
+#   clusters - GPS clusters and map cells (indexer runs)
+#   folders - the folder tree (indexer runs)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()  # memory, redis or filesystem (shared by workers)
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_DIR = os.getenv("CACHE_DIR", "/tmp/ecopix-cache")
+CACHE_TTL = int(os.getenv("CACHE_TTL", 300))  # Seconds
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 2048))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_MB", 64)) * 1024 * 1024
+
+def create_backend():
+    """Optional shared backend (cachelib, installed with flask-session); None keeps the cache in-process.
+
+    Entries are stored with explicit timeouts; the default of 0 (no expiry) is what the
+    tag generation counters get from inc().
+    """
+    if CACHE_BACKEND == "memory":
+        return None
+    try:
+        if CACHE_BACKEND == "redis":
+            from cachelib import RedisCache
+            import redis
+            return RedisCache(redis.from_url(CACHE_REDIS_URL), key_prefix="ecopix:", default_timeout=0)
+        if CACHE_BACKEND == "filesystem":
+            from cachelib import FileSystemCache
+            return FileSystemCache(CACHE_DIR, threshold=CACHE_MAX_ENTRIES, default_timeout=0)
+        logging.warning(f"Unknown CACHE_BACKEND {CACHE_BACKEND}, caching in memory")
+    except ImportError as e:
+        logging.warning(f"Cache backend {CACHE_BACKEND} unavailable ({e}), caching in memory")
+    return None
+
+class QueryCache:
+    """In-process LRU with TTL and entry/byte limits, optionally in front of a shared backend."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL, backend=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.backend = backend
+        self.entries = OrderedDict()  # key -> (pickled value, expiry)
+        self.size = 0
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def generation(self, tag):
+        if self.backend is not None:
+            return self.backend.get(f"generation:{tag}") or 0
+        return self.generations.get(tag, 0)
+
+    def versioned_key(self, key, tags):
+        return key + "|" + ",".join(f"{tag}={self.generation(tag)}" for tag in sorted(tags))
+
+    def get(self, key):
+        """Cached value of a versioned key, or None on a miss."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return pickle.loads(entry[0])
+        if self.backend is not None:
+            data = self.backend.get(key)
+            if data is not None:
+                self.store_local(key, data, self.ttl)
+                with self.lock:
+                    self.counters["hits"] += 1
+                return pickle.loads(data)
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def set(self, key, value, ttl=None):
+        data = pickle.dumps(value)
+        self.store_local(key, data, ttl or self.ttl)
+        if self.backend is not None:
+            self.backend.set(key, data, timeout=ttl or self.ttl)
+
+    def store_local(self, key, data, ttl):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old:
+                self.size -= len(old[0])
+            self.entries[key] = (data, time.monotonic() + ttl)
+            self.size += len(data)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (evicted, _) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.counters["evictions"] += 1
+
+    def get_or_compute(self, key, tags, compute, ttl=None):
+        # The key is versioned before computing, so a result that raced an invalidation
+        # is stored under the old generation and never served
+        key = self.versioned_key(key, tags)
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, ttl)
+        return value
+
+    def invalidate(self, *tags):
+        """Make every entry computed from any of the tags unreachable, in all workers when shared."""
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+            self.counters["invalidations"] += 1
+        if self.backend is not None:
+            for tag in tags:
+                self.backend.inc(f"generation:{tag}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                **self.counters,
+                "hit_rate": round(self.counters["hits"] / lookups, 3) if lookups else None,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "backend": CACHE_BACKEND if self.backend is not None else "memory",
+            }
+
+query_cache = QueryCache(backend=create_backend())
+
+def cached_response(*tags, when=None):
+    """Cache the 200 responses of a view per path and query string, invalidated by tags.
+
+    when is an optional predicate on the request, e.g. only first pages are worth caching.
+    Views wrapped by it must check the session before being called.
+    """
+    def decorate(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if when is not None and not when():
+                return view(*args, **kwargs)
+            key = query_cache.versioned_key(
+                f"response:{request.path}?{urlencode(sorted(request.args.items(multi=True)))}", tags
+            )
+            cached = query_cache.get(key)
+            if cached is not None:
+                data, mimetype = cached
+                return current_app.response_class(data, status=200, mimetype=mimetype)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                query_cache.set(key, (response.get_data(), response.mimetype))
+            return response
+        return wrapper
+    return decorate
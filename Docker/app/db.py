@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import random
 
 # Initialize SQLAlchemy object
 db = SQLAlchemy()
@@ -15,6 +16,12 @@ class Album(db.Model):
     def __repr__(self):
         return f'<Album {self.name}>'
 
+# Photo.random_key values are drawn from [0, RANDOM_KEY_RANGE)
+RANDOM_KEY_RANGE = 2 ** 31
+
+def new_random_key():
+    return random.randrange(RANDOM_KEY_RANGE)
+
 # Photo model
 class Photo(db.Model):
     __tablename__ = 'photos'  # Corrected to __tablename__
@@ -31,15 +38,56 @@ class Photo(db.Model):
     focal_length = db.Column(db.Float)  # Focal length metadata
     lens_model = db.Column(db.String(255))  # Lens model metadata
 
-    # Relationship to the Album model
-    album_id = db.Column(db.Integer, db.ForeignKey('album.id'), nullable=True)
-    album = db.relationship('Album', backref='photos', lazy=True)
+    # File manifest, compared against os.stat by rescans to find changed, moved and deleted files
+    file_size = db.Column(db.BigInteger, nullable=True)  # st_size in bytes
+    file_mtime = db.Column(db.BigInteger, nullable=True)  # st_mtime_ns, exact unlike a float
+    file_inode = db.Column(db.BigInteger, nullable=True)  # st_ino, survives renames and moves
+    content_hash = db.Column(db.String(40), nullable=True, index=True)  # sha1 of the file content, also the thumbnail key
+
+    # Albums the photo is in, through album_photos; membership is written with set-based statements
+    albums = db.relationship('Album', secondary='album_photos', lazy=True, viewonly=True, order_by='Album.id')
 
     gps_cluster_id = db.Column(db.Integer, db.ForeignKey('gps_clusters.id'), nullable=True)
+    geohash = db.Column(db.String(12), nullable=True, index=True)  # Its prefixes are the map clusters of every zoom level
+    random_key = db.Column(db.Integer, nullable=True, default=new_random_key)  # Shuffle position, see paginate_shuffled
+
+    # Indexes follow the query shapes of the list endpoints; the id tiebreak of keyset
+    # pagination is implicit (InnoDB secondary indexes carry the primary key, SQLite the rowid).
+    # Long paths are indexed by prefix on MariaDB, whose key length is limited to 3072 bytes.
+    __table_args__ = (
+        db.Index('idx_photos_gps', 'gps_latitude', 'gps_longitude'),  # Map viewport (bbox) queries
+        db.Index('idx_photos_creation_date', 'creation_date'),  # /photo/list by date
+        db.Index('idx_photos_filename', 'filename'),  # /photo/list by name
+        db.Index('idx_photos_folder_date', 'folder_path', 'creation_date',
+                 mysql_length={'folder_path': 512}),  # /folders/photos by date, subtree ranges
+        db.Index('idx_photos_folder_filename', 'folder_path', 'filename',
+                 mysql_length={'folder_path': 512}),  # /folders/photos by name
+        db.Index('idx_photos_camera_model', 'camera_model'),  # /photoexif filters
+        db.Index('idx_photos_lens_model', 'lens_model'),
+        db.Index('idx_photos_focal_length', 'focal_length'),
+        db.Index('idx_photos_gps_cluster', 'gps_cluster_id'),
+        db.Index('idx_photos_random_key', 'random_key'),  # Seeded random order
+    )
     
     def __repr__(self):
         return f'<Photo {self.filename}>'
 
+# Album membership, a photo can be in several albums.
+# Databases from before migration 6 keep an unused photos.album_id column.
+class AlbumPhoto(db.Model):
+    __tablename__ = 'album_photos'
+
+    album_id = db.Column(db.Integer, db.ForeignKey('album.id', ondelete='CASCADE'), primary_key=True)
+    photo_id = db.Column(db.Integer, db.ForeignKey('photos.id', ondelete='CASCADE'), primary_key=True)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('idx_album_photos_photo', 'photo_id'),  # Albums of a photo, membership cleanup on purge
+    )
+
+    def __repr__(self):
+        return f'<AlbumPhoto {self.album_id}:{self.photo_id}>'
+
 class GPSCluster(db.Model):
     __tablename__ = 'gps_clusters'
 
@@ -50,3 +98,111 @@ class GPSCluster(db.Model):
 
     def __repr__(self):
         return f'<GPSCluster ({self.cluster_latitude}, {self.cluster_longitude})>'
+
+# Background indexing run, see app/jobs.py
+class IndexJob(db.Model):
+    __tablename__ = 'index_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, cancelling, cancelled, completed, failed
+    rescan = db.Column(db.Boolean, nullable=False, default=False)
+    files_seen = db.Column(db.Integer, nullable=False, default=0)  # Files found on disk
+    files_total = db.Column(db.Integer, nullable=False, default=0)  # Files that need extracting
+    files_processed = db.Column(db.Integer, nullable=False, default=0)
+    files_failed = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)  # Heartbeat, refreshed on every progress report
+
+    def __repr__(self):
+        return f'<IndexJob {self.id} {self.status}>'
+
+# Photo counts per facet value, maintained by app/facets.py
+class FacetCount(db.Model):
+    __tablename__ = 'photo_facets'
+
+    id = db.Column(db.Integer, primary_key=True)
+    dimension = db.Column(db.String(20), nullable=False)  # camera, lens, focal_length, year, folder, album, gps_cluster
+    value = db.Column(db.String(1024), nullable=False)
+    photo_count = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_photo_facets_dimension', 'dimension', 'photo_count'),
+    )
+
+    def __repr__(self):
+        return f'<FacetCount {self.dimension}={self.value} ({self.photo_count})>'
+
+# Photo counts per day, overall and per folder, camera and album; maintained by app/timeline.py
+class TimelineCount(db.Model):
+    __tablename__ = 'timeline_counts'
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    dimension = db.Column(db.String(20), nullable=False)  # all, folder, camera, album
+    value = db.Column(db.String(1024), nullable=False)  # '' for all
+    photo_count = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('idx_timeline_counts_lookup', 'dimension', 'value', 'day', mysql_length={'value': 512}),
+        db.Index('idx_timeline_counts_day', 'day'),  # Incremental refresh of touched days
+    )
+
+    def __repr__(self):
+        return f'<TimelineCount {self.day} {self.dimension}={self.value} ({self.photo_count})>'
+
+# Map clusters: photo counts per geohash cell at every clustering precision; maintained by app/geocells.py
+class GeoCell(db.Model):
+    __tablename__ = 'geo_cells'
+
+    id = db.Column(db.Integer, primary_key=True)
+    precision = db.Column(db.Integer, nullable=False)  # Geohash prefix length, see geohash.ZOOM_PRECISION
+    geohash = db.Column(db.String(12), nullable=False)  # The cell, a geohash prefix
+    photo_count = db.Column(db.Integer, nullable=False)
+    latitude = db.Column(db.Float, nullable=False)  # Average position of the cell's photos
+    longitude = db.Column(db.Float, nullable=False)
+    cover_photo_id = db.Column(db.Integer, nullable=True)  # Lowest photo id of the cell
+
+    __table_args__ = (
+        db.Index('idx_geo_cells_viewport', 'precision', 'latitude', 'longitude'),  # /photo/geo
+        db.Index('idx_geo_cells_cell', 'precision', 'geohash', unique=True),  # Incremental refresh
+    )
+
+    def __repr__(self):
+        return f'<GeoCell {self.geohash} ({self.photo_count})>'
+
+# Library directories with their subtree counts, maintained by app/folders.py
+class Folder(db.Model):
+    __tablename__ = 'folders'
+
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(1024), nullable=False)  # Same form as Photo.folder_path, e.g. /Photos/2024/trip
+    name = db.Column(db.String(255), nullable=False)
+    parent_id = db.Column(db.Integer, db.ForeignKey('folders.id', ondelete='CASCADE'), nullable=True)  # None for /Photos
+    photo_count = db.Column(db.Integer, nullable=False, default=0)  # Photos directly in the folder
+    total_count = db.Column(db.Integer, nullable=False, default=0)  # Photos in the whole subtree
+    first_date = db.Column(db.DateTime, nullable=True)  # Creation date range of the subtree
+    last_date = db.Column(db.DateTime, nullable=True)
+    cover_photo_id = db.Column(db.Integer, nullable=True)  # Lowest photo id of the subtree
+    created_at = db.Column(db.DateTime, nullable=True)  # Directory ctime when the indexer last walked it
+
+    __table_args__ = (
+        db.Index('idx_folders_path', 'path', unique=True, mysql_length={'path': 768}),
+        db.Index('idx_folders_parent', 'parent_id', 'name'),  # Subfolders of a folder by name
+    )
+
+    def __repr__(self):
+        return f'<Folder {self.path}>'
+
+# Applied schema migrations, see app/migrations.py
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
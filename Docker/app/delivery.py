@@ -0,0 +1,105 @@
+import os
+import re
+import logging
+import mimetypes
+from urllib.parse import quote
+from flask import request, current_app, jsonify, send_from_directory
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# HTTP caching of image responses. Thumbnail and rendition URLs contain the content hash
+# and originals carry it as ?v=, so those URLs never change content and are cached for a
+# year as immutable; other image URLs are revalidated with their ETag on every use.
+# Responses are private as every image is behind the login.
+IMMUTABLE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", 365 * 24 * 3600))  # Seconds
+
+CONTENT_HASH = re.compile(r'[0-9a-f]{40}')
+
+# Who sends the image bytes:
+#   direct     - the WSGI server, through wsgi.file_wrapper: sendfile under gunicorn, which the
+#                image runs (gunicorn.conf.py), or uWSGI; the development server copies the bytes
+#   x-accel    - nginx, via X-Accel-Redirect to an internal location serving PHOTO_ROOT:
+#                location /_photos/ { internal; alias /Photos/; }
+#   x-sendfile - Apache mod_xsendfile or lighttpd, via X-Sendfile with the file path
+# In the proxy modes the route only checks the session and resolves the path; the proxy
+# streams the file and answers Range requests itself.
+IMAGE_DELIVERY = os.getenv("IMAGE_DELIVERY", "direct").lower()
+X_ACCEL_LOCATION = os.getenv("X_ACCEL_LOCATION", "/_photos").rstrip('/')
+PHOTO_ROOT = "/Photos"
+
+if IMAGE_DELIVERY not in ("direct", "x-accel", "x-sendfile"):
+    logging.warning(f"Unknown IMAGE_DELIVERY {IMAGE_DELIVERY}, sending images directly")
+    IMAGE_DELIVERY = "direct"
+
+def hash_of(filename):
+    """Content hash a sharded thumbnail file name is keyed by, or None for older names."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return stem if CONTENT_HASH.fullmatch(stem) else None
+
+def set_cache_headers(response, immutable):
+    response.cache_control.private = True
+    response.cache_control.public = None
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+        response.cache_control.max_age = None
+        response.headers.pop("Expires", None)
+    return response
+
+def not_modified(etag, immutable=False):
+    """304 for a request that already holds etag, or None. Checked before the file is touched."""
+    if etag is None or not request.if_none_match.contains_weak(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return set_cache_headers(response, immutable)
+
+def proxy_response(path, mimetype=None):
+    """Empty response telling the front proxy to send path, or None when it cannot reach it."""
+    if IMAGE_DELIVERY == "x-accel":
+        if not path.startswith(PHOTO_ROOT + '/'):
+            return None
+        header, value = "X-Accel-Redirect", f"{X_ACCEL_LOCATION}/{quote(path[len(PHOTO_ROOT) + 1:])}"
+    else:
+        header, value = "X-Sendfile", path
+    response = current_app.response_class(
+        mimetype=mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    )
+    response.headers[header] = value
+    return response
+
+def file_not_found():
+    """The JSON 404 of the image routes, as a response object so callers can add headers."""
+    response = jsonify({"message": "File not found"})
+    response.status_code = 404
+    return response
+
+def send_image(directory, filename, etag=None, immutable=False, mimetype=None):
+    """Send an image with a strong ETag (the content hash when known) and cache headers.
+
+    If-None-Match is answered without opening the file. When sent directly,
+    If-Modified-Since, Range and If-Range are handled by Werkzeug's conditional responses;
+    in the proxy modes the proxy handles them.
+    """
+    response = not_modified(etag, immutable)
+    if response is not None:
+        return response
+    if IMAGE_DELIVERY != "direct":
+        path = safe_join(directory, filename)
+        if path is None:
+            return file_not_found()
+        response = proxy_response(path, mimetype)
+        if response is not None:
+            if etag is not None:
+                response.set_etag(etag)
+            return set_cache_headers(response, immutable)
+    try:
+        response = send_from_directory(directory, filename, etag=etag or True, conditional=True,
+                                       as_attachment=False, mimetype=mimetype)
+    except NotFound:
+        # The same JSON 404 as the proxy modes, whichever IMAGE_DELIVERY is set
+        return file_not_found()
+    return set_cache_headers(response, immutable)
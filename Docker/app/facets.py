@@ -0,0 +1,134 @@
+from app.db import db, Photo, AlbumPhoto, FacetCount
+from app.cache import query_cache
+from datetime import datetime
+
+# Facet dimensions: name -> (grouped expression, type of its values)
+FACETS = {
+    'camera': (Photo.camera_model, str),
+    'lens': (Photo.lens_model, str),
+    'focal_length': (Photo.focal_length, float),
+    'year': (db.extract('year', Photo.creation_date), int),
+    'folder': (Photo.folder_path, str),
+    'album': (AlbumPhoto.album_id, int),
+    'gps_cluster': (Photo.gps_cluster_id, int),
+}
+
+# Dimensions whose expression lives on another table: name -> (table, join condition)
+FACET_JOINS = {
+    'album': (AlbumPhoto, AlbumPhoto.photo_id == Photo.id),
+}
+
+FACET_LIMIT = 100  # Values returned per dimension, most frequent first
+
+# Counts under filters are cached per distinct filter set until photos or albums change;
+# the summary table is refreshed after every indexing run and album change
+
+VALUE_CHUNK = 100  # Touched values recounted per statement
+
+# Touched float values are matched with a tolerance: FLOAT columns are single precision on MariaDB
+FLOAT_TOLERANCE = 0.001
+
+def refresh_facets(dimensions=None, values=None):
+    """Rebuild the photo_facets rows of the given dimensions (all by default), one INSERT ... SELECT each.
+
+    values maps dimension names to the values an index run touched (as the photos table
+    holds them); then only the rows of those values are recounted, over the index of the
+    dimension, and dimensions without touched values are left alone.
+    """
+    for name in dimensions or (FACETS if values is None else values):
+        if values is None:
+            db.session.execute(db.delete(FacetCount).where(FacetCount.dimension == name))
+            insert_facet(name)
+        else:
+            refresh_facet_values(name, values.get(name, ()))
+    db.session.commit()
+
+def refresh_facet_values(name, values):
+    """Recount the rows of the given values of one dimension; the commit is left to the caller."""
+    values = list(values)
+    for start in range(0, len(values), VALUE_CHUNK):
+        chunk = values[start:start + VALUE_CHUNK]
+        db.session.execute(db.delete(FacetCount).where(FacetCount.dimension == name, stored_values(name, chunk)))
+        insert_facet(name, photo_values(name, chunk))
+
+def insert_facet(name, *conditions):
+    expression, _ = FACETS[name]
+    db.session.execute(
+        db.insert(FacetCount).from_select(
+            ["dimension", "value", "photo_count"],
+            facet_source(name, db.select(db.literal(name), db.cast(expression, db.String), db.func.count(Photo.id)))
+            .where(expression.isnot(None), *conditions)
+            .group_by(expression),
+        )
+    )
+
+def photo_values(name, values):
+    """Photos with one of the given values of a dimension."""
+    expression, value_type = FACETS[name]
+    if name == 'year':
+        # Ranges of creation_date rather than the year of every photo
+        return db.or_(*(
+            db.and_(Photo.creation_date >= datetime(year, 1, 1), Photo.creation_date < datetime(year + 1, 1, 1))
+            for year in values
+        ))
+    if value_type is float:
+        return db.or_(*(expression.between(value - FLOAT_TOLERANCE, value + FLOAT_TOLERANCE) for value in values))
+    return expression.in_(values)
+
+def stored_values(name, values):
+    """photo_facets rows of one dimension holding one of the given values."""
+    _, value_type = FACETS[name]
+    if value_type is float:
+        # The text of a float depends on the database, so compare the numbers
+        ids = [
+            row.id for row in db.session.query(FacetCount.id, FacetCount.value).filter(FacetCount.dimension == name)
+            if any(abs(float(row.value) - value) <= FLOAT_TOLERANCE for value in values)
+        ]
+        return FacetCount.id.in_(ids)
+    return FacetCount.value.in_([str(value) for value in values])
+
+def facet_source(name, statement):
+    statement = statement.select_from(Photo)
+    if name in FACET_JOINS:
+        statement = statement.join(*FACET_JOINS[name])
+    return statement
+
+def facet_values(name, rows):
+    _, value_type = FACETS[name]
+    return [{"value": value_type(value), "count": count} for value, count in rows]
+
+def condition_key(condition):
+    compiled = condition.compile()
+    return str(compiled), tuple(sorted((k, str(v)) for k, v in compiled.params.items()))
+
+def facet_counts(conditions):
+    """Photo counts per value of every dimension, under the filters of the other dimensions.
+
+    conditions maps dimension name -> filter condition. A dimension's own filter is left
+    out of its counts, so a multi-select UI keeps showing its alternatives. Dimensions not
+    narrowed by any other filter come straight from the summary table.
+    """
+    facets = {}
+    for name, (expression, _) in FACETS.items():
+        others = [condition for dimension, condition in conditions.items() if dimension != name]
+        if not others:
+            rows = db.session.query(FacetCount.value, FacetCount.photo_count).filter(
+                FacetCount.dimension == name
+            ).order_by(FacetCount.photo_count.desc()).limit(FACET_LIMIT).all()
+            facets[name] = facet_values(name, rows)
+            continue
+
+        key = f"facets:{name}:{sorted(condition_key(condition) for condition in others)}"
+        facets[name] = query_cache.get_or_compute(
+            key, ('photos', 'albums'), lambda: count_facet(name, expression, others)
+        )
+    return facets
+
+def count_facet(name, expression, conditions):
+    count = db.func.count(Photo.id)
+    rows = db.session.execute(
+        facet_source(name, db.select(expression, count))
+        .where(expression.isnot(None), *conditions)
+        .group_by(expression).order_by(count.desc()).limit(FACET_LIMIT)
+    ).all()
+    return facet_values(name, rows)
@@ -0,0 +1,134 @@
+from app.db import db, Photo, Folder
+from datetime import datetime
+import os
+
+# Folder tree of the library, so that browsing folders never touches the file system.
+# Paths have the form of Photo.folder_path; counts, dates and cover of a folder cover its
+# whole subtree, except photo_count which only counts the photos directly in it.
+ROOT_FOLDER = '/Photos'
+
+DELETE_CHUNK = 500
+
+def parent_path(path):
+    if path == ROOT_FOLDER or not path.startswith(ROOT_FOLDER + '/'):
+        return None
+    return os.path.dirname(path)
+
+def subtree_condition(column, path):
+    """column is path or under it, as two index ranges rather than LIKE ('0' follows '/')."""
+    return db.or_(column == path, db.and_(column > path + '/', column < path + '0'))
+
+def in_scopes(path, scopes):
+    return any(
+        path == top or (recursive and path.startswith(top + '/'))
+        for top, recursive in scopes
+    )
+
+def earliest(*values):
+    values = [value for value in values if value is not None]
+    return min(values) if values else None
+
+def latest(*values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+def chunks(values, size=DELETE_CHUNK):
+    values = list(values)
+    return (values[start:start + size] for start in range(0, len(values), size))
+
+def load_folders(paths, scopes):
+    """Folder rows of the given paths and of the scopes, with their children, by path."""
+    conditions = [Folder.path.in_(chunk) for chunk in chunks(paths)]
+    conditions += [subtree_condition(Folder.path, top) for top, recursive in scopes if recursive]
+    folders = {}
+    for chunk in chunks(conditions, 100):
+        folders.update((folder.path, folder) for folder in Folder.query.filter(db.or_(*chunk)))
+    for chunk in chunks([folder.id for folder in folders.values()]):
+        folders.update((folder.path, folder) for folder in Folder.query.filter(Folder.parent_id.in_(chunk)))
+    return folders
+
+def refresh_folders(directories=None, scopes=(), folder_paths=None):
+    """Bring the folders table in line with the photos table and the directories an index run walked.
+
+    directories maps folder paths to the ctime of the directory; scopes are the
+    (path, recursive) trees the run walked, where folders that were not seen and hold no
+    photos are dropped. Counts come from one GROUP BY over idx_photos_folder_date and
+    are rolled up the tree in Python, which has one row per directory.
+
+    folder_paths, the folders whose photos a run added, changed, moved or removed, limits
+    the recount to them, the walked directories and scopes and their ancestors; the other
+    children of those folders are rolled up with their stored counts.
+    """
+    directories = directories or {}
+    recount = None
+    if folder_paths is None:
+        folders = {folder.path: folder for folder in Folder.query.all()}
+    else:
+        recount = {ROOT_FOLDER} | set(folder_paths) | set(directories) | {top for top, _ in scopes}
+        for path in list(recount):
+            while (path := parent_path(path)) is not None:
+                recount.add(path)
+        folders = load_folders(recount, scopes)
+        recount.update(path for path in folders if in_scopes(path, scopes))
+
+    statement = db.session.query(
+        Photo.folder_path,
+        db.func.count(Photo.id).label('photo_count'),
+        db.func.min(Photo.creation_date).label('first_date'),
+        db.func.max(Photo.creation_date).label('last_date'),
+        db.func.min(Photo.id).label('cover_id'),
+    ).filter(Photo.folder_path.isnot(None)).group_by(Photo.folder_path)
+    if recount is None:
+        direct = {row.folder_path: row for row in statement}
+    else:
+        direct = {row.folder_path: row for chunk in chunks(recount) for row in statement.filter(Photo.folder_path.in_(chunk))}
+
+    wanted = {ROOT_FOLDER} | set(direct) | set(directories)
+    wanted.update(path for path in folders if not in_scopes(path, scopes))
+    for path in list(wanted):
+        while (path := parent_path(path)) is not None:
+            wanted.add(path)
+
+    # Children go with their parent through the foreign key
+    removed = [folders.pop(path).id for path in set(folders) - wanted]
+    for chunk in chunks(removed):
+        db.session.execute(db.delete(Folder).where(Folder.id.in_(chunk)))
+    for path in sorted(wanted - set(folders)):
+        folders[path] = Folder(path=path, name=os.path.basename(path) or path)
+        db.session.add(folders[path])
+    for path, ctime in directories.items():
+        folders[path].created_at = datetime.fromtimestamp(ctime)
+    db.session.flush()  # Ids of the new folders
+
+    # Deepest first, so every folder has all of its children added in when it is reached
+    totals = {}
+    for path, folder in folders.items():
+        row = direct.get(path)
+        if recount is not None and path not in recount:
+            totals[path] = (folder.total_count, folder.first_date, folder.last_date, folder.cover_photo_id)
+        else:
+            totals[path] = (row.photo_count, row.first_date, row.last_date, row.cover_id) if row else (0, None, None, None)
+    for path in sorted(folders, key=lambda path: path.count('/'), reverse=True):
+        folder = folders[path]
+        total, first_date, last_date, cover_id = totals[path]
+        parent = parent_path(path)
+        if recount is None or path in recount:
+            folder.photo_count = direct[path].photo_count if path in direct else 0
+            folder.total_count = total
+            folder.first_date = first_date
+            folder.last_date = last_date
+            folder.cover_photo_id = cover_id
+            folder.parent_id = folders[parent].id if parent is not None else None
+
+        if parent is not None:
+            parent_total, parent_first, parent_last, parent_cover = totals[parent]
+            totals[parent] = (
+                parent_total + total,
+                earliest(parent_first, first_date),
+                latest(parent_last, last_date),
+                earliest(parent_cover, cover_id),
+            )
+    db.session.commit()
+
+def get_folder(path):
+    return Folder.query.filter(Folder.path == path).first()
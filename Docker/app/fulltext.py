@@ -0,0 +1,125 @@
+from app.db import db, Photo, Album, AlbumPhoto
+from sqlalchemy.dialects.mysql import match
+import re
+
+# Full-text index over filename, folder path, camera, lens and album name.
+# SQLite (the fallback) uses an FTS5 table kept in sync by triggers; MariaDB uses
+# FULLTEXT indexes on the tables themselves, which InnoDB maintains on every write.
+FTS_TABLE = 'photos_fts'
+MAX_TERMS = 10
+
+# Album names of a photo, space separated; {photo_id} is the SQL expression of the photo id
+ALBUM_NAMES = """(SELECT group_concat(album.name, ' ') FROM album_photos
+    JOIN album ON album.id = album_photos.album_id WHERE album_photos.photo_id = {photo_id})"""
+
+SQLITE_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        filename, folder_path, camera_model, lens_model, album_name,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS photos_fts_insert AFTER INSERT ON photos BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, filename, folder_path, camera_model, lens_model, album_name)
+        VALUES (new.id, new.filename, new.folder_path, new.camera_model, new.lens_model,
+                {ALBUM_NAMES.format(photo_id='new.id')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS photos_fts_update
+    AFTER UPDATE OF filename, folder_path, camera_model, lens_model ON photos BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+        INSERT INTO {FTS_TABLE} (rowid, filename, folder_path, camera_model, lens_model, album_name)
+        VALUES (new.id, new.filename, new.folder_path, new.camera_model, new.lens_model,
+                {ALBUM_NAMES.format(photo_id='new.id')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS photos_fts_delete AFTER DELETE ON photos BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS album_photos_fts_insert AFTER INSERT ON album_photos BEGIN
+        UPDATE {FTS_TABLE} SET album_name = {ALBUM_NAMES.format(photo_id='new.photo_id')}
+        WHERE rowid = new.photo_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS album_photos_fts_delete AFTER DELETE ON album_photos BEGIN
+        UPDATE {FTS_TABLE} SET album_name = {ALBUM_NAMES.format(photo_id='old.photo_id')}
+        WHERE rowid = old.photo_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS album_fts_rename AFTER UPDATE OF name ON album BEGIN
+        UPDATE {FTS_TABLE} SET album_name = {ALBUM_NAMES.format(photo_id=f'{FTS_TABLE}.rowid')}
+        WHERE rowid IN (SELECT photo_id FROM album_photos WHERE album_id = new.id);
+    END""",
+]
+
+SQLITE_FILL = f"""INSERT INTO {FTS_TABLE} (rowid, filename, folder_path, camera_model, lens_model, album_name)
+    SELECT photos.id, photos.filename, photos.folder_path, photos.camera_model, photos.lens_model,
+           {ALBUM_NAMES.format(photo_id='photos.id')}
+    FROM photos"""
+
+# Triggers of the single album_id schema, replaced by migration 6
+SQLITE_OLD_TRIGGERS = ('photos_fts_insert', 'photos_fts_update', 'album_fts_rename')
+
+# MariaDB FULLTEXT indexes: name -> (table, columns)
+MARIADB_INDEXES = {
+    'ft_photos_text': ('photos', ('filename', 'folder_path', 'camera_model', 'lens_model')),
+    'ft_album_name': ('album', ('name',)),
+}
+PHOTO_TEXT_COLUMNS = (Photo.filename, Photo.folder_path, Photo.camera_model, Photo.lens_model)
+
+def is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+def create_fulltext():
+    """Create the full-text index of the current database and fill it from the photos table."""
+    if is_sqlite():
+        exists = db.inspect(db.engine).has_table(FTS_TABLE)
+        for statement in SQLITE_SCHEMA:
+            db.session.execute(db.text(statement))
+        if not exists:
+            db.session.execute(db.text(SQLITE_FILL))
+    else:
+        inspector = db.inspect(db.engine)
+        for name, (table, columns) in MARIADB_INDEXES.items():
+            if name not in {index['name'] for index in inspector.get_indexes(table)}:
+                db.session.execute(db.text(f"ALTER TABLE {table} ADD FULLTEXT INDEX {name} ({', '.join(columns)})"))
+    db.session.commit()
+
+def rebuild_album_names():
+    """Recreate the SQLite triggers and album names after the move to album_photos."""
+    if not is_sqlite():
+        return
+    for trigger in SQLITE_OLD_TRIGGERS:
+        db.session.execute(db.text(f"DROP TRIGGER IF EXISTS {trigger}"))
+    create_fulltext()
+    db.session.execute(db.text(
+        f"UPDATE {FTS_TABLE} SET album_name = {ALBUM_NAMES.format(photo_id=f'{FTS_TABLE}.rowid')}"
+    ))
+    db.session.commit()
+
+def search_terms(text):
+    """Words of a search box input; operators and punctuation are dropped."""
+    return re.findall(r'[^\W_]+', text.lower())[:MAX_TERMS]
+
+def ranked_matches(text):
+    """Subquery of (id, score) for photos matching every word of text as a prefix; lower scores rank higher.
+
+    On MariaDB the words must all match the photo's own columns or all match one of its
+    album names, as the two FULLTEXT indexes live on different tables.
+    """
+    terms = search_terms(text)
+    if not terms:
+        raise ValueError("The search has no words to match")
+
+    if is_sqlite():
+        fts_query = ' '.join(f'"{term}"*' for term in terms)
+        return db.select(
+            db.literal_column('rowid').label('id'),
+            db.literal_column('rank').label('score'),
+        ).select_from(db.table(FTS_TABLE)).where(
+            db.text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=fts_query)
+        ).subquery()
+
+    boolean_query = ' '.join(f'+{term}*' for term in terms)
+    photo_match = match(*PHOTO_TEXT_COLUMNS, against=boolean_query).in_boolean_mode()
+    album_match = match(Album.name, against=boolean_query).in_boolean_mode()
+    matches = db.union_all(
+        db.select(Photo.id.label('id'), (-photo_match).label('score')).where(photo_match),
+        db.select(AlbumPhoto.photo_id.label('id'), (-album_match).label('score'))
+        .join(Album, Album.id == AlbumPhoto.album_id).where(album_match),
+    ).subquery()
+    return db.select(matches.c.id, db.func.min(matches.c.score).label('score')).group_by(matches.c.id).subquery()
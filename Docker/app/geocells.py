@@ -0,0 +1,46 @@
+from app.db import db, Photo, GeoCell
+from app import geohash
+
+# Map clusters of every zoom level, precomputed: one row per geohash cell and precision,
+# so /photo/geo reads a few hundred rows from an index instead of grouping photos.
+PRECISIONS = sorted(set(geohash.ZOOM_PRECISION))
+
+PREFIX_CHUNK = 100  # Cells refreshed per statement
+
+def in_cell(prefix):
+    """Photo.geohash starts with prefix, as an index range ('{' follows 'z', the last geohash character)."""
+    return db.and_(Photo.geohash >= prefix, Photo.geohash < prefix + '{')
+
+def insert_cells(precision, *conditions):
+    cell = db.func.substr(Photo.geohash, 1, precision)
+    db.session.execute(
+        db.insert(GeoCell).from_select(
+            ["precision", "geohash", "photo_count", "latitude", "longitude", "cover_photo_id"],
+            db.select(
+                db.literal(precision), cell, db.func.count(Photo.id),
+                db.func.avg(Photo.gps_latitude), db.func.avg(Photo.gps_longitude), db.func.min(Photo.id),
+            ).where(Photo.geohash.isnot(None), *conditions).group_by(cell),
+        )
+    )
+
+def refresh_geo_cells(geohashes=None):
+    """Recount the cells containing the given geohashes at every precision, or rebuild them all.
+
+    The indexer passes the geohashes of the photos it added, changed or removed, so a run
+    only touches their cells; each chunk is one DELETE and one INSERT ... SELECT per precision
+    over index ranges of Photo.geohash.
+    """
+    if geohashes is None:
+        db.session.execute(db.delete(GeoCell))
+        for precision in PRECISIONS:
+            insert_cells(precision)
+        db.session.commit()
+        return
+
+    for precision in PRECISIONS:
+        prefixes = sorted({value[:precision] for value in geohashes if value})
+        for start in range(0, len(prefixes), PREFIX_CHUNK):
+            chunk = prefixes[start:start + PREFIX_CHUNK]
+            db.session.execute(db.delete(GeoCell).where(GeoCell.precision == precision, GeoCell.geohash.in_(chunk)))
+            insert_cells(precision, db.or_(*(in_cell(prefix) for prefix in chunk)))
+    db.session.commit()
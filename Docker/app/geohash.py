@@ -0,0 +1,32 @@
+# Geohash encoding, used to cluster geotagged photos at every map zoom level:
+# photos sharing the first n characters lie in the same cell, so one indexed
+# column serves all zoom levels through its prefixes.
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+PRECISION = 12
+
+def encode(latitude, longitude, precision=PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, interval = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (interval[0] + interval[1]) / 2
+        bits <<= 1
+        if value >= middle:
+            bits |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits, bit_count = 0, 0
+    return ''.join(chars)
+
+# Web map zoom level -> geohash prefix length giving cells of roughly 40-80 px on screen
+ZOOM_PRECISION = [1, 1, 2, 2, 2, 3, 3, 4, 4, 4, 5, 5, 6, 6, 6, 7, 7, 8]
+
+def precision_for_zoom(zoom):
+    return ZOOM_PRECISION[max(0, min(zoom, len(ZOOM_PRECISION) - 1))]
@@ -1,47 +1,124 @@
 import os
+import io
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-from PIL import Image, ExifTags
+from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
-import piexif
-from app.db import db, Photo, GPSCluster
+from app.db import db, Photo, AlbumPhoto, GPSCluster
+from app.migrations import migrate
+from app import geohash
+from app.facets import FACETS, refresh_facets
+from app.timeline import refresh_timeline
+from app.folders import ROOT_FOLDER, refresh_folders
+from app.geocells import refresh_geo_cells
+from app.cache import query_cache
+from app.renditions import EAGER_RENDITION_SIZES, prepare_image, save_image, save_eager_renditions, remove_renditions, shard
 import logging
 from flask import current_app
 
+# Pointers from IFD0 to the Exif and GPS sub-IFDs
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+
+class IndexCancelled(Exception):
+    """Raised by a progress callback to stop an index run between batches."""
+
+# Photo columns behind the facet dimensions, see app/facets.py
+FACET_COLUMNS = {
+    'camera': 'camera_model',
+    'lens': 'lens_model',
+    'focal_length': 'focal_length',
+    'folder': 'folder_path',
+    'gps_cluster': 'gps_cluster_id',
+}
+
+class Touched:
+    """What an index run changed, so that the rollups recount only that.
+
+    Holds the days for the timeline, the values of every facet dimension, the folders
+    and the geohashes of the photos added, changed, moved or removed.
+    """
+
+    def __init__(self):
+        self.days = set()
+        self.facets = {name: set() for name in FACETS}
+        self.folders = set()
+        self.geohashes = set()
+
+    #record the values of one photo, a manifest row before a change or the fields stored after it
+    def add(self, values):
+        creation_date = values.get("creation_date")
+        if creation_date is not None:
+            self.days.add(creation_date.date())
+            self.facets['year'].add(creation_date.year)
+        for name, column in FACET_COLUMNS.items():
+            if values.get(column) is not None:
+                self.facets[name].add(values[column])
+        if values.get("folder_path") is not None:
+            self.folders.add(values["folder_path"])
+        if values.get("geohash") is not None:
+            self.geohashes.add(values["geohash"])
+
+# Indexer owned by each pool worker process, built once by _init_worker
+_worker_indexer = None
+
+def _init_worker(photo_dir, thumbnail_dir):
+    global _worker_indexer
+    _worker_indexer = PhotoIndexer(photo_dir, thumbnail_dir, workers=1)
+
+def _extract_in_worker(image_path):
+    return _worker_indexer.extract_photo(image_path)
+
 class PhotoIndexer:
     #define the config
-    def __init__(self, photo_dir="/Photos", thumbnail_dir="/Photos/thumbnail"):
+    def __init__(self, photo_dir="/Photos", thumbnail_dir="/Photos/thumbnail", workers=None, batch_size=None, progress=None):
         self.photos_dir = photo_dir
         self.thumbnail_dir=thumbnail_dir
         self.supported_formats={'.jpg','.jpeg','.png','.gif'}
+        self.thumbnail_size = (300, 300)
+        # Number of processes doing the CPU-bound work, defaults to the CPU count
+        self.workers = workers or os.cpu_count() or 1
+        # Files handed to the pool per round trip
+        self.chunk_size = 16
+        # Rows per multi-row INSERT/UPDATE statement and per commit
+        self.batch_size = batch_size or 500
+        # Optional callback receiving progress counters, see report()
+        self.progress = progress
 
     #create thumbnail direcotry if it doesn't exist
     def setup_direcotries(self):
         if not os.path.exists(self.thumbnail_dir):
             os.makedirs(self.thumbnail_dir)
 
-    #convert image date time
-    def get_image_datetime(self, image_path):
+    #convert image date time, from the EXIF already read by extract_photo or else the file's mtime
+    def get_image_datetime(self, image_path, exif_data, mtime):
         try:
-            exif_dict = piexif.load(image_path)
-            if "Exif" in exif_dict and piexif.ExifIFD.DateTimeOriginal in exif_dict["Exif"]:
-                date_str = exif_dict["Exif"][piexif.ExifIFD.DateTimeOriginal].decode()
+            if exif_data and "DateTimeOriginal" in exif_data:
+                date_str = str(exif_data["DateTimeOriginal"]).strip("\x00 ")
                 return datetime.strptime(date_str, '%Y:%m:%d %H:%M:%S')
         except Exception as e:
             logging.warning(f"Could not read EXIF date for {image_path}: {str(e)}")
         
         # Fallback to file modification time
-        return datetime.fromtimestamp(os.path.getmtime(image_path))
+        return datetime.fromtimestamp(mtime)
 
-    def get_exif(self, image_path):
-        image = Image.open(image_path)
-        exif_data = image._getexif()
-        if not exif_data:
+    #read every EXIF field we use from an already opened image, without decoding any pixels
+    def read_exif(self, img):
+        exif = img.getexif()
+        if not exif:
             return None
-        return {
-            TAGS.get(tag, tag): value
-            for tag, value in exif_data.items()
-        }
-    
+        exif_data = {TAGS.get(tag, tag): value for tag, value in exif.items()}
+        # Date, focal length and lens live in the Exif sub-IFD, coordinates in the GPS sub-IFD
+        exif_data.update({TAGS.get(tag, tag): value for tag, value in exif.get_ifd(EXIF_IFD).items()})
+        gps_info = exif.get_ifd(GPS_IFD)
+        if gps_info:
+            exif_data["GPSInfo"] = dict(gps_info)
+        else:
+            exif_data.pop("GPSInfo", None)
+        return exif_data
+
     #convert gps info
     def get_decimal_from_dms(self, dms, ref):
         degrees = dms[0]
@@ -53,7 +130,7 @@ class PhotoIndexer:
         return decimal
 
     def get_gps_data(self, exif_data):
-        if 'GPSInfo' not in exif_data:
+        if not exif_data or 'GPSInfo' not in exif_data:
             return None
         gps_info = exif_data['GPSInfo']
         gps_data = {}
@@ -86,7 +163,7 @@ class PhotoIndexer:
                 # Convert fractional focal length to float
                 camera_details["focal_length"] = focal_length[0] / focal_length[1]
             else:
-                camera_details["focal_length"] = focal_length
+                camera_details["focal_length"] = float(focal_length)
 
         # Lens information (if available)
         if "LensModel" in exif_data:
@@ -94,175 +171,516 @@ class PhotoIndexer:
 
         return camera_details
     
-    #generate thunbnail
-    from PIL import Image, ExifTags
+    #thumbnails are keyed by content hash and sharded as ab/cd/<hash>.jpg, so equal files share
+    #one thumbnail and no directory grows past a few hundred entries
+    def get_thumbnail_path(self, content_hash):
+        return os.path.join(self.thumbnail_dir, shard(content_hash, 'jpg'))
 
-    def generate_thumbnail(self, image_path):
+    #write the thumbnail of an already opened image, plus the other eager renditions
+    def save_thumbnail(self, img, thumbnail_path, exif_data=None, content_hash=None):
         try:
-            filename = os.path.basename(image_path)
-            thumbnail_path = os.path.join(self.thumbnail_dir, f"thumb_{filename}")
-            
-            with Image.open(image_path) as img:
-                # Correct orientation using EXIF data
-                try:
-                    for orientation in ExifTags.TAGS.keys():
-                        if ExifTags.TAGS[orientation] == 'Orientation':
-                            break
-                    exif = img._getexif()
-                    if exif and orientation in exif:
-                        orientation_value = exif[orientation]
-                        if orientation_value == 3:
-                            img = img.rotate(180, expand=True)
-                        elif orientation_value == 6:
-                            img = img.rotate(270, expand=True)
-                        elif orientation_value == 8:
-                            img = img.rotate(90, expand=True)
-                except Exception as e:
-                    logging.warning(f"Could not correct orientation for {image_path}: {e}")
-                
-                # Convert to RGB if necessary
-                if img.mode in ('RGBA', 'P'):
-                    img = img.convert('RGB')
-                
-                # Create thumbnail
-                img.thumbnail((300, 300))
-                img.save(thumbnail_path, "JPEG")
-            
+            orientation = exif_data.get("Orientation") if exif_data else None
+            # Decode once at the largest eager size and derive every smaller image from it
+            largest = max([max(self.thumbnail_size)] + EAGER_RENDITION_SIZES)
+            img = prepare_image(img, largest, orientation)
+
+            thumbnail = img.copy()
+            thumbnail.thumbnail(self.thumbnail_size)
+            save_image(thumbnail, thumbnail_path, 'jpeg')
+
+            if content_hash:
+                save_eager_renditions(img, content_hash)
             return thumbnail_path
         except Exception as e:
-            logging.error(f"Failed to generate thumbnail for {image_path}: {e}")
+            logging.error(f"Failed to generate thumbnail {thumbnail_path}: {e}")
             return None
 
-    
-    #index photos
-    def index_photos(self):
-        """Index all photos in the photos directory"""
-        self.setup_direcotries()  # Ensure directories are properly set up
+    # Determine folder path relative to the base photos directory
+    def get_folder_path(self, full_path):
+        return self.get_dir_folder_path(os.path.dirname(full_path))
 
-        for root, _, files in os.walk(self.photos_dir):
-            # Skip thumbnail directory
-            if root == self.thumbnail_dir:
+    def get_dir_folder_path(self, root):
+        # normpath turns the library root into /Photos rather than /Photos/.
+        return os.path.normpath(f"{ROOT_FOLDER}/{os.path.relpath(root, self.photos_dir)}")
+
+    def hash_file(self, path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        return sha1.hexdigest()
+
+    #extract the fields of a Photo row; runs inside pool workers, so it must not touch the db session
+    def extract_photo(self, full_path):
+        try:
+            # Read the file once: the bytes are hashed for the manifest, EXIF comes
+            # from the header and the thumbnail from a reduced decode
+            with open(full_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                data = f.read()
+            content_hash = hashlib.sha1(data).hexdigest()
+            thumbnail_path = self.get_thumbnail_path(content_hash)
+            with Image.open(io.BytesIO(data)) as img:
+                exif_data = self.read_exif(img)
+                # The same content indexed before already has its thumbnail
+                if not os.path.exists(thumbnail_path):
+                    thumbnail_path = self.save_thumbnail(img, thumbnail_path, exif_data, content_hash)
+            if not thumbnail_path:
+                return None
+
+            # Get creation time
+            creation_time = self.get_image_datetime(full_path, exif_data, stat.st_mtime)
+
+            # Get GPS data
+            gps_data = self.get_gps_data(exif_data)
+            lat = gps_data.get("latitude") if gps_data else None
+            lon = gps_data.get("longitude") if gps_data else None
+
+            # Get camera details
+            camera_details = self.get_camera_details(exif_data)
+            camera_model = camera_details.get("camera_model") if camera_details else None
+            focal_length = camera_details.get("focal_length") if camera_details else None
+            lens_model = camera_details.get("lens_model") if camera_details else None
+
+            return {
+                "filename": os.path.basename(full_path),
+                "filepath": full_path,
+                "folder_path": self.get_folder_path(full_path),  # Store the relative folder path
+                "thumbnail_path": thumbnail_path,
+                "creation_date": creation_time,
+                "gps_latitude": lat,
+                "gps_longitude": lon,
+                "geohash": geohash.encode(lat, lon) if lat is not None and lon is not None else None,
+                "camera_model": camera_model,
+                "focal_length": focal_length,
+                "lens_model": lens_model,
+                "file_size": stat.st_size,
+                "file_mtime": stat.st_mtime_ns,
+                "file_inode": stat.st_ino,
+                "content_hash": content_hash,
+            }
+        except Exception as e:
+            logging.error(f"Error indexing photo {full_path}: {str(e)}")
+            return None
+
+    #process pool for extract_photo, or no pool at all when running with a single worker
+    #or when there is too little work to be worth starting one
+    def create_pool(self, file_count=None):
+        if self.workers > 1 and (file_count is None or file_count > self.chunk_size):
+            return ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=_init_worker,
+                initargs=(self.photos_dir, self.thumbnail_dir),
+            )
+        return nullcontext()
+
+    def extract_photos(self, paths, pool=None):
+        """Run extract_photo over paths, in the pool when there is one, preserving order."""
+        if pool is None:
+            return map(self.extract_photo, paths)
+        return pool.map(_extract_in_worker, paths, chunksize=self.chunk_size)
+
+    #hand progress counters to the caller; the callback may raise IndexCancelled to stop the run
+    def report(self, **counts):
+        if self.progress:
+            self.progress(**counts)
+
+    #keep the caller's heartbeat fresh between long stages that must not be stopped halfway
+    def heartbeat(self):
+        if self.progress:
+            self.progress(cancellable=False)
+
+    #run an executemany-style bulk INSERT/UPDATE in statements of at most batch_size rows
+    def execute_batched(self, statement, rows):
+        for start in range(0, len(rows), self.batch_size):
+            db.session.execute(statement, rows[start:start + self.batch_size])
+
+    #store a batch of new or changed photos; only the parent process talks to the database
+    def store_photos(self, pending, pool=None, touched=None):
+        paths = [full_path for full_path, _ in pending]
+        new_rows, changed_rows = [], []
+        for (full_path, photo_id), fields in zip(pending, self.extract_photos(paths, pool)):
+            if not fields:
                 continue
-                
+            if photo_id is None:
+                new_rows.append(fields)
+            else:
+                # The file changed, so its coordinates may have moved to another cluster
+                changed_rows.append(dict(fields, id=photo_id, gps_cluster_id=None))
+
+        # Core multi-row statements: no ORM objects, so the identity map stays empty
+        if new_rows:
+            self.execute_batched(db.insert(Photo), new_rows)
+        if changed_rows:
+            self.execute_batched(db.update(Photo), changed_rows)
+        db.session.commit()
+        if touched is not None:
+            for fields in new_rows + changed_rows:
+                # Rows without a date get the column default, the current time
+                touched.add(dict(fields, creation_date=fields.get("creation_date") or datetime.utcnow()))
+        return len(new_rows) + len(changed_rows), len(pending) - len(new_rows) - len(changed_rows)
+
+    #one query for everything a rescan needs to know about the indexed files,
+    #streamed from the server cursor instead of buffering the whole result twice
+    def load_manifest(self, paths=None, folders=None):
+        """Map filepath to manifest row, for the whole library or only for the given scope.
+
+        paths are files or directory trees (which need not exist anymore), folders
+        are single directories without their subdirectories.
+        """
+        query = db.session.query(
+            Photo.id, Photo.filepath, Photo.thumbnail_path, Photo.file_size,
+            Photo.file_mtime, Photo.file_inode, Photo.content_hash, Photo.creation_date,
+            # What the rollups count the photo under, for Touched
+            Photo.folder_path, Photo.camera_model, Photo.lens_model, Photo.focal_length,
+            Photo.gps_cluster_id, Photo.geohash,
+        )
+        if paths is None and folders is None:
+            return {row.filepath: row for row in query.yield_per(self.batch_size * 10)}
+
+        conditions = []
+        for path in paths or ():
+            path = path.rstrip('/')
+            # A range on the unique filepath index rather than LIKE, so '%' and '_' need no escaping
+            conditions.append(Photo.filepath == path)
+            conditions.append(db.and_(Photo.filepath > path + '/', Photo.filepath < path + '0'))
+        for folder in folders or ():
+            conditions.append(Photo.folder_path == self.get_dir_folder_path(folder.rstrip('/')))
+
+        manifest = {}
+        for start in range(0, len(conditions), 100):
+            for row in query.filter(db.or_(*conditions[start:start + 100])):
+                manifest[row.filepath] = row
+        return manifest
+
+    #walk the library, or one directory tree of it, and stat every supported file.
+    #directories collects the folder path and ctime of every directory walked
+    def scan_files(self, top=None, recursive=True, directories=None):
+        for root, dirs, files in os.walk(top or self.photos_dir):
+            # Skip thumbnail directory
+            dirs[:] = [d for d in dirs if recursive and os.path.join(root, d) != self.thumbnail_dir]
+            if directories is not None:
+                try:
+                    directories[self.get_dir_folder_path(root)] = os.stat(root).st_ctime
+                except OSError as e:
+                    logging.warning(f"Could not stat {root}: {e}")
+
             for filename in files:
                 if os.path.splitext(filename)[1].lower() in self.supported_formats:
                     full_path = os.path.join(root, filename)
-                    
-                    # Check if photo is already indexed
-                    existing_photo = Photo.query.filter_by(filepath=full_path).first()
-                    if existing_photo:
-                        continue
-                    
                     try:
-                        # Generate thumbnail
-                        thumbnail_path = self.generate_thumbnail(full_path)
-                        if not thumbnail_path:
-                            continue
-                        
-                        # Get EXIF data
-                        exif_data = self.get_exif(full_path)
-                        
-                        # Get creation time
-                        creation_time = self.get_image_datetime(full_path)
-                        
-                        # Get GPS data
-                        gps_data = self.get_gps_data(exif_data)
-                        lat = gps_data.get("latitude") if gps_data else None
-                        lon = gps_data.get("longitude") if gps_data else None
-                        
-                        # Get camera details
-                        camera_details = self.get_camera_details(exif_data)
-                        camera_model = camera_details.get("camera_model") if camera_details else None
-                        focal_length = camera_details.get("focal_length") if camera_details else None
-                        lens_model = camera_details.get("lens_model") if camera_details else None
-                        
-                        # Determine folder path relative to the base photos directory
-                        folder_path = f"/Photos/{os.path.relpath(root, self.photos_dir)}"
-                        
-                        # Create new photo record
-                        new_photo = Photo(
-                            filename=filename,
-                            filepath=full_path,
-                            folder_path=folder_path,  # Store the relative folder path
-                            thumbnail_path=thumbnail_path,
-                            creation_date=creation_time,
-                            gps_latitude=lat,
-                            gps_longitude=lon,
-                            camera_model=camera_model,
-                            focal_length=focal_length,
-                            lens_model=lens_model,
-                            album_id=None  # Set to None initially; albums can be assigned later
-                        )
-                        
-                        db.session.add(new_photo)
-                    
-                    except Exception as e:
-                        logging.error(f"Error indexing photo {full_path}: {str(e)}")
-            
-            # Commit after processing each directory to avoid large transactions
-            db.session.commit()
+                        yield full_path, os.stat(full_path)
+                    except OSError as e:
+                        logging.warning(f"Could not stat {full_path}: {e}")
+
+    #pair new files with vanished rows by inode, or by content hash when the inode changed.
+    #A rename keeps the mtime, while a freed inode reused by a new file does not
+    def match_moves(self, new_files, missing):
+        by_inode = {
+            (row.file_inode, row.file_size, row.file_mtime): row
+            for row in missing if row.file_inode is not None
+        }
+        by_size = {}
+        for row in missing:
+            if row.content_hash:
+                by_size.setdefault(row.file_size, []).append(row)
+
+        moves, remaining, matched = [], [], set()
+        for full_path, stat in new_files:
+            row = by_inode.get((stat.st_ino, stat.st_size, stat.st_mtime_ns))
+            if (row is None or row.id in matched) and stat.st_size in by_size:
+                # Only hash files whose size matches a vanished photo
+                content_hash = self.hash_file(full_path)
+                row = next((r for r in by_size[stat.st_size]
+                            if r.content_hash == content_hash and r.id not in matched), None)
+            if row is None or row.id in matched:
+                remaining.append((full_path, stat))
+                continue
+            matched.add(row.id)
+            moves.append((row, full_path, stat))
+        return moves, remaining, [row for row in missing if row.id not in matched]
+
+    #update moved photos in place, keeping their thumbnails
+    def move_photos(self, moves):
+        if not moves:
+            return
+        self.execute_batched(db.update(Photo), [
+            {
+                "id": row.id,
+                "filename": os.path.basename(full_path),
+                "filepath": full_path,
+                "folder_path": self.get_folder_path(full_path),
+                "file_mtime": stat.st_mtime_ns,
+                "file_inode": stat.st_ino,
+            }
+            for row, full_path, stat in moves
+        ])
+        db.session.commit()
+
+    #delete rows of vanished files, and their thumbnails once nothing else uses them
+    def purge_photos(self, rows, touched=None):
+        if not rows:
+            return
+        ids = [row.id for row in rows]
+        for start in range(0, len(ids), self.batch_size):
+            batch = ids[start:start + self.batch_size]
+            if touched is not None:
+                touched.facets['album'].update(
+                    album_id for (album_id,) in db.session.query(AlbumPhoto.album_id)
+                    .filter(AlbumPhoto.photo_id.in_(batch)).distinct()
+                )
+            AlbumPhoto.query.filter(AlbumPhoto.photo_id.in_(batch)).delete(synchronize_session=False)
+            Photo.query.filter(Photo.id.in_(batch)).delete(synchronize_session=False)
+        db.session.commit()
+        self.remove_unused_thumbnails({row.thumbnail_path for row in rows})
+
+    #delete thumbnail files, and the other renditions of the same content, no photo row points at anymore
+    def remove_unused_thumbnails(self, thumbnails):
+        thumbnails = list({path for path in thumbnails if path})
+        still_used = set()
+        for start in range(0, len(thumbnails), self.batch_size):
+            still_used.update(
+                path for (path,) in db.session.query(Photo.thumbnail_path)
+                .filter(Photo.thumbnail_path.in_(thumbnails[start:start + self.batch_size])).distinct()
+            )
+        for path in set(thumbnails) - still_used:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.warning(f"Could not remove thumbnail {path}: {e}")
+            content_hash = os.path.splitext(os.path.basename(path))[0]
+            if len(content_hash) == 40:
+                remove_renditions(content_hash)
+
+    #record size/mtime/inode for rows indexed before the manifest existed
+    def backfill_manifest(self, legacy):
+        self.execute_batched(db.update(Photo), [
+            {"id": photo_id, "file_size": stat.st_size, "file_mtime": stat.st_mtime_ns, "file_inode": stat.st_ino}
+            for photo_id, stat in legacy
+        ])
+        db.session.commit()
+
+    #index photos
+    def index_photos(self, rescan=False):
+        """Index all photos in the photos directory.
+
+        Files are diffed against the manifest loaded in one query, so unchanged files
+        only cost a stat. With rescan, changed files are re-extracted, moved files are
+        updated in place and rows of deleted files are purged.
+        """
+        self.setup_direcotries()  # Ensure directories are properly set up
+        touched, directories = Touched(), {}
+        try:
+            self.sync_files(self.scan_files(directories=directories), self.load_manifest(), rescan, touched)
+        except IndexCancelled:
+            # The batches stored so far are committed; bring the rollups in line with them.
+            # The walk was cut short, so no folder is taken as gone from disk
+            self.refresh_rollups(touched, directories, ())
+            raise
+        self.refresh_rollups(touched, directories, [(ROOT_FOLDER, True)])
+
+    def index_changes(self, paths=(), folders=()):
+        """Rescan only the given files or directory trees, and single folders.
+
+        Used by the watcher, so that a handful of new files never costs a walk of the
+        whole library. A path that no longer exists purges the rows under it.
+        """
+        self.setup_direcotries()
+
+        files, directories = {}, {}
+        for path in paths:
+            if os.path.isdir(path):
+                files.update(self.scan_files(path, directories=directories))
+            elif os.path.isfile(path) and os.path.splitext(path)[1].lower() in self.supported_formats:
+                files[path] = os.stat(path)
+        for folder in folders:
+            if os.path.isdir(folder):
+                files.update(self.scan_files(folder, recursive=False, directories=directories))
+
+        touched = self.sync_files(files.items(), self.load_manifest(paths, folders), rescan=True, touched=Touched())
+        scopes = [(self.get_dir_folder_path(path.rstrip('/')), True) for path in paths]
+        scopes += [(self.get_dir_folder_path(folder.rstrip('/')), False) for folder in folders]
+        self.refresh_rollups(touched, directories, scopes, scoped=True)
+
+    #bring everything derived from the photos table in line with it, then drop the cached reads of it.
+    #The timeline recounts the touched days only; a scoped run (the watcher's) also limits the
+    #facets, folders and map cells to what it touched, a full run rebuilds them
+    def refresh_rollups(self, touched, directories, scopes, scoped=False):
         #after indexing photos, index gps cluster
-        self.index_gps_clusters()
+        self.heartbeat()
+        self.index_gps_clusters(touched if scoped else None)
+        self.heartbeat()
+        refresh_timeline(touched.days)
+        self.heartbeat()
+        refresh_geo_cells(touched.geohashes if scoped else None)
+        self.heartbeat()
+        refresh_facets(values=touched.facets if scoped else None)
+        self.heartbeat()
+        refresh_folders(directories, scopes, touched.folders if scoped else None)
+        # Only once every rollup has committed: a read in between would cache the old
+        # rollups under the new generation
+        query_cache.invalidate('photos', 'albums', 'clusters', 'folders')
+
+    #diff (path, stat) pairs against manifest rows covering the same scope, and apply the result
+    def sync_files(self, files, manifest, rescan, touched):
+        """Index new files and, with rescan, apply changes, moves and deletions.
 
-    def index_gps_clusters(self):
-        """Group photos by GPS coordinates and populate the GPSCluster table."""
+        Records what the changes touched in touched (a Touched), for the rollups, as each
+        change commits; a cancelled run leaves what its committed work touched.
+        """
+        new_files, changed, legacy, seen = [], [], [], set()
+        files_seen = 0
+        for files_seen, (full_path, stat) in enumerate(files, 1):
+            if files_seen % 10000 == 0:
+                self.report(files_seen=files_seen)
+            row = manifest.get(full_path)
+            if row is None:
+                new_files.append((full_path, stat))
+                continue
+            seen.add(full_path)
+            if row.file_size is None:
+                legacy.append((row.id, stat))
+            if rescan and (row.content_hash is None or row.file_size != stat.st_size
+                           or row.file_mtime != stat.st_mtime_ns):
+                # Also rows indexed before content hashes, to move them to keyed thumbnails
+                changed.append((full_path, row.id))
+
+        if legacy:
+            self.backfill_manifest(legacy)
+
+        if rescan:
+            missing = [row for path, row in manifest.items() if path not in seen]
+            moves, new_files, deleted = self.match_moves(new_files, missing)
+            self.move_photos(moves)
+            self.purge_photos(deleted, touched)
+            if moves or deleted:
+                query_cache.invalidate('photos', 'albums')
+            for row in [row for row, _, _ in moves] + deleted + [manifest[full_path] for full_path, _ in changed]:
+                touched.add(row._mapping)
+            for _, full_path, _ in moves:
+                touched.add({"folder_path": self.get_folder_path(full_path)})
+            logging.info(f"Rescan: {len(changed)} changed, {len(moves)} moved, {len(deleted)} deleted")
+
+        pending = [(full_path, None) for full_path, _ in new_files] + changed
+        self.report(files_seen=files_seen, files_total=len(pending))
+
+        processed = failed = 0
+        with self.create_pool(len(pending)) as pool:
+            # Commit in batches big enough to keep every worker busy
+            for start in range(0, len(pending), self.batch_size):
+                stored, skipped = self.store_photos(pending[start:start + self.batch_size], pool, touched)
+                # Every batch is a commit list readers can see; refresh_rollups invalidates again
+                query_cache.invalidate('photos')
+                processed += stored
+                failed += skipped
+                self.report(files_processed=processed, files_failed=failed)
+
+        # Changed content gets a new thumbnail key; drop the old ones
+        self.remove_unused_thumbnails({manifest[full_path].thumbnail_path for full_path, _ in changed})
+        return touched
+
+    def index_gps_clusters(self, touched=None):
+        """Group photos by GPS coordinates and populate the GPSCluster table.
+
+        Set-based and incremental: only photos without a cluster (new or changed since the
+        last run) are assigned, with one INSERT ... SELECT for the grid cells that have no
+        cluster yet and one UPDATE for the photos. Counts are then refreshed with a single
+        UPDATE and clusters left empty by deleted photos are dropped. The clusters whose
+        count changed are added to touched, for the gps_cluster facet.
+        """
         try:
-            # Clear existing clusters
-            db.session.query(GPSCluster).delete()
-            db.session.commit()
+            self.backfill_geohashes(touched)
+            counts = dict(db.session.query(GPSCluster.id, GPSCluster.photo_count).all()) if touched is not None else {}
 
-            # Query to group photos by rounded GPS coordinates using SQLAlchemy ORM
-            clusters = (
-                db.session.query(
-                    db.func.round(Photo.gps_latitude, 2).label("cluster_latitude"),
-                    db.func.round(Photo.gps_longitude, 2).label("cluster_longitude"),
-                    db.func.count(Photo.id).label("photo_count")
-                )
-                .filter(Photo.gps_latitude.isnot(None), Photo.gps_longitude.isnot(None))
-                .group_by(
-                    db.func.round(Photo.gps_latitude, 2),
-                    db.func.round(Photo.gps_longitude, 2)
-                )
-                .all()
+            cell_latitude = db.func.round(Photo.gps_latitude, 2)
+            cell_longitude = db.func.round(Photo.gps_longitude, 2)
+            unassigned = db.and_(
+                Photo.gps_cluster_id.is_(None),
+                Photo.gps_latitude.isnot(None),
+                Photo.gps_longitude.isnot(None),
+            )
+            # Grid cells are 0.01 apart; match them with a tolerance rather than float equality,
+            # FLOAT columns on MariaDB are single precision
+            in_cell = db.and_(
+                GPSCluster.cluster_latitude.between(cell_latitude - 0.001, cell_latitude + 0.001),
+                GPSCluster.cluster_longitude.between(cell_longitude - 0.001, cell_longitude + 0.001),
             )
 
-            for cluster in clusters:
-                # Create a new GPSCluster
-                gps_cluster = GPSCluster(
-                    cluster_latitude=cluster.cluster_latitude,
-                    cluster_longitude=cluster.cluster_longitude,
-                    photo_count=cluster.photo_count
-                )
-                db.session.add(gps_cluster)
-                db.session.commit()
-
-                # Assign photos to this cluster
-                photos = (
-                    Photo.query.filter(
-                        db.func.round(Photo.gps_latitude, 2) == cluster.cluster_latitude,
-                        db.func.round(Photo.gps_longitude, 2) == cluster.cluster_longitude
-                    ).all()
+            # Create clusters for the cells of unassigned photos that have none yet
+            new_cells = (
+                db.select(cell_latitude, cell_longitude, db.literal(0))
+                .where(unassigned, ~db.exists().where(in_cell))
+                .group_by(cell_latitude, cell_longitude)
+            )
+            db.session.execute(
+                db.insert(GPSCluster).from_select(
+                    ["cluster_latitude", "cluster_longitude", "photo_count"], new_cells
                 )
+            )
 
-                for photo in photos:
-                    photo.gps_cluster_id = gps_cluster.id
-                    db.session.add(photo)  # Add the updated photo record to the session
+            # Assign photos to their cluster
+            cluster_id = db.select(GPSCluster.id).where(in_cell).limit(1).scalar_subquery()
+            db.session.execute(
+                db.update(Photo).where(unassigned).values(gps_cluster_id=cluster_id)
+                .execution_options(synchronize_session=False)
+            )
 
+            # Refresh the counts and drop clusters whose photos are all gone
+            photo_count = (
+                db.select(db.func.count(Photo.id))
+                .where(Photo.gps_cluster_id == GPSCluster.id)
+                .scalar_subquery()
+            )
+            db.session.execute(
+                db.update(GPSCluster).values(photo_count=photo_count)
+                .execution_options(synchronize_session=False)
+            )
+            db.session.execute(
+                db.delete(GPSCluster).where(GPSCluster.photo_count == 0)
+                .execution_options(synchronize_session=False)
+            )
             db.session.commit()
+            if touched is not None:
+                new_counts = dict(db.session.query(GPSCluster.id, GPSCluster.photo_count).all())
+                touched.facets['gps_cluster'].update(
+                    cluster_id for cluster_id in counts.keys() | new_counts.keys()
+                    if counts.get(cluster_id) != new_counts.get(cluster_id)
+                )
 
-            print("GPS clusters indexed successfully.")
+            logging.info("GPS clusters indexed successfully.")
         except Exception as e:
             db.session.rollback()
             logging.error(f"Error indexing GPS clusters: {e}")
 
     
+    #geohash rows indexed before the column existed; new rows get theirs from extract_photo
+    def backfill_geohashes(self, touched=None):
+        rows = (
+            db.session.query(Photo.id, Photo.gps_latitude, Photo.gps_longitude)
+            .filter(Photo.geohash.is_(None), Photo.gps_latitude.isnot(None), Photo.gps_longitude.isnot(None))
+            .all()
+        )
+        if rows:
+            values = [
+                {"id": row.id, "geohash": geohash.encode(row.gps_latitude, row.gps_longitude)}
+                for row in rows
+            ]
+            self.execute_batched(db.update(Photo), values)
+            db.session.commit()
+            if touched is not None:
+                touched.geohashes.update(value["geohash"] for value in values)
+
     #Initialize the indexer with the Flask app context
     @staticmethod
-    def init_indexer():
+    def init_indexer(rescan=False, progress=None):
         with current_app.app_context():
             # Create tables if they don't exist
-            db.create_all()
+            migrate()
             
             # Create and run indexer
-            indexer = PhotoIndexer()
-            indexer.index_photos()
\ No newline at end of file
+            indexer = PhotoIndexer(
+                workers=current_app.config.get('INDEX_WORKERS'),
+                batch_size=current_app.config.get('INDEX_BATCH_SIZE'),
+                progress=progress,
+            )
+            indexer.index_photos(rescan=rescan)
\ No newline at end of file
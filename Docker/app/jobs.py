@@ -0,0 +1,151 @@
+import threading
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from flask import current_app
+from app.db import db, IndexJob
+from app.indexer import PhotoIndexer, IndexCancelled
+
+# Single-flight guard for this process; the job table covers other worker processes
+_index_lock = threading.Lock()
+
+ACTIVE_STATUSES = ('queued', 'running', 'cancelling')
+
+# A running job whose heartbeat is older than this belongs to a process that died
+STALE_AFTER = timedelta(minutes=10)
+
+def job_to_dict(job):
+    """Job status with throughput (files/s) and ETA (seconds) derived from its counters."""
+    throughput = eta = None
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+        done = job.files_processed + job.files_failed
+        if elapsed > 0 and done:
+            throughput = round(done / elapsed, 2)
+            if job.status in ACTIVE_STATUSES:
+                eta = round(max(job.files_total - done, 0) / throughput, 1)
+    return {
+        "id": job.id,
+        "status": job.status,
+        "rescan": job.rescan,
+        "files_seen": job.files_seen,
+        "files_total": job.files_total,
+        "files_processed": job.files_processed,
+        "files_failed": job.files_failed,
+        "throughput": throughput,
+        "eta_seconds": eta,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+def get_active_job(check_stale=True):
+    """Return the job currently indexing, failing jobs whose process went away.
+
+    Pass check_stale=False while this process holds the indexing lock: the job is then
+    alive here, however old its heartbeat.
+    """
+    job = IndexJob.query.filter(IndexJob.status.in_(ACTIVE_STATUSES)).order_by(IndexJob.id.desc()).first()
+    if check_stale and job and job.updated_at and datetime.utcnow() - job.updated_at > STALE_AFTER:
+        job.status = 'failed'
+        job.error = 'Indexing process stopped responding'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return None
+    return job
+
+def get_job(job_id=None):
+    """Return a job by id, or the most recent one."""
+    if job_id is not None:
+        return db.session.get(IndexJob, job_id)
+    return IndexJob.query.order_by(IndexJob.id.desc()).first()
+
+def start_index_job(rescan=False):
+    """Queue an index run on a background thread.
+
+    Returns (job, started); when a run is already active, that job is returned
+    with started=False instead of starting a second one.
+    """
+    if not _index_lock.acquire(blocking=False):
+        return get_active_job(check_stale=False), False
+    try:
+        active = get_active_job()
+        if active:
+            _index_lock.release()
+            return active, False
+
+        job = IndexJob(status='queued', rescan=rescan)
+        db.session.add(job)
+        db.session.commit()
+
+        app = current_app._get_current_object()
+        thread = threading.Thread(target=_run_index_job, args=(app, job.id, rescan), daemon=True)
+        thread.start()
+        return job, True
+    except Exception:
+        _index_lock.release()
+        raise
+
+@contextmanager
+def index_lock():
+    """Non-blocking hold on the indexing lock for work outside of jobs (e.g. the watcher).
+
+    Yields False when an index job is running, in which case the caller should retry later.
+    """
+    acquired = _index_lock.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _index_lock.release()
+
+def cancel_job(job):
+    """Ask a queued or running job to stop after its current batch."""
+    if job.status in ('queued', 'running'):
+        job.status = 'cancelling'
+        db.session.commit()
+    return job
+
+def _run_index_job(app, job_id, rescan):
+    with app.app_context():
+        try:
+            # Only a job still queued starts; one cancelled meanwhile is finished right away
+            started = IndexJob.query.filter_by(id=job_id, status='queued').update({
+                "status": 'running',
+                "started_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow(),
+            })
+            db.session.commit()
+            if not started:
+                raise IndexCancelled()
+
+            def progress(cancellable=True, **counts):
+                # Counters and heartbeat go to the job row; a cancel request shows up as its status
+                counts['updated_at'] = datetime.utcnow()
+                IndexJob.query.filter_by(id=job_id).update(counts)
+                db.session.commit()
+                status = db.session.query(IndexJob.status).filter_by(id=job_id).scalar()
+                if cancellable and status == 'cancelling':
+                    raise IndexCancelled()
+
+            PhotoIndexer.init_indexer(rescan=rescan, progress=progress)
+            _finish_job(job_id, 'completed')
+        except IndexCancelled:
+            logging.info(f"Index job {job_id} cancelled")
+            _finish_job(job_id, 'cancelled')
+        except Exception as e:
+            logging.error(f"Index job {job_id} failed: {str(e)}")
+            _finish_job(job_id, 'failed', str(e))
+        finally:
+            _index_lock.release()
+
+def _finish_job(job_id, status, error=None):
+    db.session.rollback()
+    IndexJob.query.filter_by(id=job_id).update({
+        "status": status,
+        "error": error,
+        "finished_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    })
+    db.session.commit()
@@ -0,0 +1,125 @@
+from app.db import db, Photo, SchemaVersion, new_random_key
+from app.facets import refresh_facets
+from app.timeline import refresh_timeline
+from app.fulltext import create_fulltext, rebuild_album_names
+from app.folders import ROOT_FOLDER, refresh_folders
+from app.geocells import refresh_geo_cells
+from datetime import datetime
+import logging
+
+# Ordered schema migrations: (version, description, upgrade function, run on fresh databases).
+# Append new entries with the next version number; never renumber or edit applied ones.
+# Objects that db.create_all() does not know about (triggers, virtual tables, FULLTEXT
+# indexes) need on_fresh, so that new databases get them too.
+MIGRATIONS = []
+
+def migration(version, description, on_fresh=False):
+    def register(upgrade):
+        MIGRATIONS.append((version, description, upgrade, on_fresh))
+        return upgrade
+    return register
+
+def add_missing_columns(table):
+    """ALTER TABLE ... ADD COLUMN for model columns the existing table lacks (all nullable)."""
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns(table.name)}
+    for column in table.columns:
+        if column.name not in existing:
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+    db.session.commit()
+
+def create_indexes(table):
+    for index in table.indexes:
+        index.create(db.engine, checkfirst=True)
+
+@migration(1, "Photo file manifest and geohash columns")
+def add_photo_columns():
+    add_missing_columns(Photo.__table__)
+    create_indexes(Photo.__table__)
+
+@migration(2, "Photo indexes for list, album, folder and exif queries")
+def add_photo_indexes():
+    create_indexes(Photo.__table__)
+
+@migration(3, "Photo random_key for seeded random order")
+def add_photo_random_keys():
+    add_missing_columns(Photo.__table__)
+    while True:
+        ids = db.session.execute(
+            db.select(Photo.id).where(Photo.random_key.is_(None)).limit(1000)
+        ).scalars().all()
+        if not ids:
+            break
+        db.session.execute(db.update(Photo), [{"id": photo_id, "random_key": new_random_key()} for photo_id in ids])
+        db.session.commit()
+    create_indexes(Photo.__table__)
+
+@migration(4, "photo_facets summary table")
+def fill_photo_facets():
+    refresh_facets()
+
+@migration(5, "Full-text search index", on_fresh=True)
+def add_fulltext_index():
+    create_fulltext()
+
+@migration(6, "album_photos membership table")
+def move_album_membership():
+    if 'album_id' in {column['name'] for column in db.inspect(db.engine).get_columns(Photo.__tablename__)}:
+        db.session.execute(db.text(
+            "INSERT INTO album_photos (album_id, photo_id, added_at) "
+            "SELECT album_id, id, :now FROM photos WHERE album_id IS NOT NULL"
+        ), {"now": datetime.utcnow()})
+        # The column is left in place, cleared so that its foreign key never blocks an album delete
+        db.session.execute(db.text("UPDATE photos SET album_id = NULL WHERE album_id IS NOT NULL"))
+        db.session.commit()
+    refresh_facets(('album',))
+    rebuild_album_names()
+
+@migration(7, "timeline_counts rollup table")
+def fill_timeline_counts():
+    refresh_timeline()
+
+@migration(8, "folders tree table")
+def fill_folders():
+    # Photos in the library root were stored with the folder path /Photos/.
+    updated = db.session.execute(
+        db.update(Photo).where(Photo.folder_path == f"{ROOT_FOLDER}/.").values(folder_path=ROOT_FOLDER)
+    ).rowcount
+    db.session.commit()
+    if updated:
+        refresh_facets(('folder',))
+        refresh_timeline()
+    # Directories without photos appear with the next index run, which walks the library
+    refresh_folders()
+
+@migration(9, "Photo index for folder listings by name")
+def add_folder_filename_index():
+    create_indexes(Photo.__table__)
+
+@migration(10, "geo_cells map cluster rollup table")
+def fill_geo_cells():
+    refresh_geo_cells()
+
+def get_schema_version():
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+def migrate():
+    """Create missing tables and bring an existing database up to the latest schema in place.
+
+    db.create_all() only creates missing tables. A database that already has a photos
+    table but no recorded version predates versioning and is treated as version 0;
+    a fresh database is created at the latest schema and only stamped, apart from the
+    migrations marked on_fresh.
+    """
+    fresh = not db.inspect(db.engine).has_table(Photo.__tablename__)
+    db.create_all()
+    current = get_schema_version()
+
+    for version, description, upgrade, on_fresh in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version <= current:
+            continue
+        if not fresh or on_fresh:
+            logging.info(f"Applying schema migration {version}: {description}")
+            upgrade()
+        db.session.add(SchemaVersion(version=version, description=description))
+        db.session.commit()
@@ -1,10 +1,254 @@
 from flask import request, current_app, jsonify, session
-from sqlalchemy import desc, func, or_
-from app.db import Photo, Album
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
-from app.db import db, Album, Photo, GPSCluster
+from sqlalchemy import desc, func, or_, and_
+from sqlalchemy.orm import load_only, selectinload, aliased
+from datetime import datetime, date, timedelta
+from app.db import db, Album, AlbumPhoto, Photo, Folder, GPSCluster, GeoCell, RANDOM_KEY_RANGE
+from app.renditions import RENDITION_SIZES
+from app import geohash
+from app.facets import facet_counts, refresh_facet_values
+from app.fulltext import ranked_matches
+from app.cache import query_cache, cached_response
+from app.timeline import refresh_timeline_album, day_counts
+from app.folders import ROOT_FOLDER, get_folder, subtree_condition
+import os
+import json
+import base64
+import hashlib
 
+THUMBNAIL_DIR = "/Photos/thumbnail"
+
+def get_rendition_urls(content_hash):
+    """URLs of every rendition size; the format follows the client's Accept header."""
+    if not content_hash:
+        return None
+    return {str(size): f"/pic/rendition/{size}/{content_hash}" for size in RENDITION_SIZES}
+
+def get_thumbnail_url(thumbnail_path):
+    """Hosted URL of a thumbnail, e.g. /pic/thumbnail/ab/cd/<hash>.jpg."""
+    if not thumbnail_path:
+        return None
+    return f"/pic/thumbnail/{os.path.relpath(thumbnail_path, THUMBNAIL_DIR)}"
+
+def get_photo_url(filepath, content_hash=None):
+    """Hosted URL of an original; the content hash as ?v= makes it cacheable as immutable."""
+    if not filepath:
+        return None
+    url = f"/pic/photos/{filepath.replace('/Photos/', '')}"
+    return f"{url}?v={content_hash}" if content_hash else url
+
+def serialize_album(album):
+    if not album:
+        return None
+    return {"id": album.id, "name": album.name, "creation_date": album.creation_date.isoformat()}
+
+# Serializable photo fields: name -> (columns it reads, value)
+PHOTO_FIELDS = {
+    "id": ((Photo.id,), lambda photo: photo.id),
+    "filename": ((Photo.filename,), lambda photo: photo.filename),
+    "filepath": ((Photo.filepath,), lambda photo: photo.filepath),
+    "folderpath": ((Photo.folder_path,), lambda photo: photo.folder_path),
+    "thumbnail_url": ((Photo.thumbnail_path,), lambda photo: get_thumbnail_url(photo.thumbnail_path)),
+    "renditions": ((Photo.content_hash,), lambda photo: get_rendition_urls(photo.content_hash)),
+    "photo_url": ((Photo.filepath, Photo.content_hash), lambda photo: get_photo_url(photo.filepath, photo.content_hash)),
+    "creation_date": ((Photo.creation_date,), lambda photo: photo.creation_date.isoformat() if photo.creation_date else None),
+    "gps_latitude": ((Photo.gps_latitude,), lambda photo: photo.gps_latitude),
+    "gps_longitude": ((Photo.gps_longitude,), lambda photo: photo.gps_longitude),
+    "camera_model": ((Photo.camera_model,), lambda photo: photo.camera_model),
+    "focal_length": ((Photo.focal_length,), lambda photo: photo.focal_length),
+    "lens_model": ((Photo.lens_model,), lambda photo: photo.lens_model),
+    "album": ((), lambda photo: serialize_album(photo.albums[0] if photo.albums else None)),  # First album, kept for older clients
+    "albums": ((), lambda photo: [serialize_album(album) for album in photo.albums]),
+}
+
+# Fields of /folders/photos when the client does not pick any
+FOLDER_PHOTO_FIELDS = ("id", "filename", "thumbnail_url", "photo_url", "creation_date", "camera_model", "focal_length", "lens_model")
+
+class InvalidFields(ValueError):
+    """A fields= parameter naming fields that do not exist."""
+
+def get_fields(default=tuple(PHOTO_FIELDS)):
+    """Fields requested with fields=a,b,c, or the default set."""
+    fields = request.args.get('fields')
+    if not fields:
+        return list(default)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in PHOTO_FIELDS]
+    if unknown:
+        raise InvalidFields(f"Unknown fields: {', '.join(unknown)}")
+    return names
+
+def photo_query_options(fields):
+    """Loader options that select only the columns of the fields, with the albums of a whole page in one query."""
+    # The sort keys are always loaded, keyset pagination reads them from the last row
+    columns = {column.key: column for column in (Photo.id, Photo.creation_date, Photo.filename, Photo.random_key)}
+    for name in fields:
+        columns.update((column.key, column) for column in PHOTO_FIELDS[name][0])
+    options = [load_only(*columns.values())]
+    if "album" in fields or "albums" in fields:
+        options.append(selectinload(Photo.albums).load_only(Album.name, Album.creation_date))
+    return options
+
+def serialize_photo(photo, fields):
+    return {name: PHOTO_FIELDS[name][1](photo) for name in fields}
+
+class InvalidCursor(ValueError):
+    """A cursor that does not decode, or belongs to another order."""
+
+# Sort key of every order that supports keyset pagination: (column, descending)
+KEYSET_ORDERS = {
+    'new-to-old': (Photo.creation_date, True),
+    'old-to-new': (Photo.creation_date, False),
+    'a-z': (Photo.filename, False),
+    'z-a': (Photo.filename, True),
+}
+
+def encode_cursor(order, value, photo_id):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([order, value, photo_id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor, order):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        cursor_order, value, photo_id = json.loads(payload)
+        if cursor_order != order:
+            raise ValueError
+        if value is not None and order in KEYSET_ORDERS and KEYSET_ORDERS[order][0] is Photo.creation_date:
+            value = datetime.fromisoformat(value)
+        return value, int(photo_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor for this order")
+
+def keyset_after(column, descending, value, last_id):
+    """Rows sorting after (value, last_id); NULLs sort first ascending and last descending."""
+    if value is None:
+        if descending:
+            return and_(column.is_(None), Photo.id < last_id)
+        return or_(column.isnot(None), and_(column.is_(None), Photo.id > last_id))
+    if descending:
+        return or_(column < value, column.is_(None), and_(column == value, Photo.id < last_id))
+    return or_(column > value, and_(column == value, Photo.id > last_id))
+
+def count_total(query):
+    """COUNT(*) of a query, cached per distinct statement until photos or albums change."""
+    statement = query.statement.compile()
+    key = f"count:{statement}:{sorted((k, str(v)) for k, v in statement.params.items())}"
+    return query_cache.get_or_compute(key, ('photos', 'albums'), lambda: query.order_by(None).count())
+
+def paginate_photos(query, order, page, per_page):
+    """Order and page a photo query; returns (photos, pagination fields of the response).
+
+    With a cursor parameter (empty for the first page) pagination is keyset based on
+    (sort column, id): every page is an index range scan after the last row of the
+    previous one, so deep pages cost the same as the first. The response then carries
+    next_cursor, and total only when include_total=1 (cached). Without a cursor the
+    classic page/per_page OFFSET pagination is used.
+    """
+    cursor = request.args.get('cursor')
+    seed = request.args.get('seed')
+    if order == 'random' and seed:
+        return paginate_shuffled(query, seed, cursor, page, per_page)
+    if cursor is not None and order in KEYSET_ORDERS:
+        column, descending = KEYSET_ORDERS[order]
+        if cursor:
+            value, last_id = decode_cursor(cursor, order)
+            query = query.filter(keyset_after(column, descending, value, last_id))
+        base_query = query
+        if descending:
+            query = query.order_by(desc(column), desc(Photo.id))
+        else:
+            query = query.order_by(column, Photo.id)
+
+        # One extra row tells whether there is a next page
+        photos = query.limit(per_page + 1).all()
+        next_cursor = None
+        if len(photos) > per_page:
+            photos = photos[:per_page]
+            last = photos[-1]
+            next_cursor = encode_cursor(order, getattr(last, column.key), last.id)
+
+        pagination = {"next_cursor": next_cursor, "per_page": per_page}
+        if request.args.get('include_total', '0').lower() in ('1', 'true') and not cursor:
+            pagination["total"] = count_total(base_query)
+        return photos, pagination
+    if cursor is not None:
+        raise InvalidCursor(f"Cursor pagination with order={order} requires a seed")
+
+    return paginate_offset(order_photos(query, order), page, per_page)
+
+def order_photos(query, order):
+    if order == 'new-to-old':
+        query = query.order_by(desc(Photo.creation_date))
+    elif order == 'old-to-new':
+        query = query.order_by(Photo.creation_date)
+    elif order == 'a-z':
+        query = query.order_by(Photo.filename)
+    elif order == 'z-a':
+        query = query.order_by(desc(Photo.filename))
+    elif order == 'random':
+        query = query.order_by(func.random())  # Reshuffled on every request, pass a seed for stable pages
+    return query
+
+def paginate_offset(query, page, per_page):
+    paginated_photos = query.paginate(page=page, per_page=per_page, error_out=False)
+    return paginated_photos.items, {
+        "total": paginated_photos.total,
+        "page": paginated_photos.page,
+        "pages": paginated_photos.pages,
+        "per_page": paginated_photos.per_page,
+    }
+
+def shuffle_key(seed):
+    """Sort key of a seeded shuffle: random_key through an affine map of the random_key space
+    with a seed-drawn odd factor and offset, a different permutation for every seed."""
+    digest = hashlib.sha1(seed.encode()).digest()
+    factor = int.from_bytes(digest[:4], 'big') % RANDOM_KEY_RANGE | 1  # Odd, so the map is one to one
+    offset = int.from_bytes(digest[4:8], 'big') % RANDOM_KEY_RANGE
+    # Both factors are below 2**31, so the product fits a 64 bit integer
+    key = (Photo.random_key * factor + offset) % RANDOM_KEY_RANGE
+    return key, f"random:{digest[:8].hex()}"
+
+def paginate_shuffled(query, seed, cursor, page, per_page):
+    """Seeded shuffle: photos ordered by a per-seed permutation of their random_key.
+
+    random_key is a per-photo random number and shuffle_key mixes it with the seed, so the
+    order is the same for every page of a seed while two seeds share no neighbours. The
+    mixed key is computed per row, so each page sorts the filtered rows; keyset cursors
+    carry (mixed key, id).
+    """
+    key, order = shuffle_key(seed)
+    if cursor is None:
+        return paginate_offset(query.order_by(key, Photo.id), page, per_page)
+
+    base_query = query
+    if cursor:
+        value, last_id = decode_cursor(cursor, order)
+        # Shuffle cursors always carry a mixed random_key
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise InvalidCursor("Invalid cursor for this order")
+        query = query.filter(or_(key > value, and_(key == value, Photo.id > last_id)))
+
+    # One extra row tells whether there is a next page
+    photos = query.add_columns(key.label('shuffle_key')).order_by(key, Photo.id).limit(per_page + 1).all()
+    next_cursor = None
+    if len(photos) > per_page:
+        photos = photos[:per_page]
+        next_cursor = encode_cursor(order, photos[-1].shuffle_key, photos[-1][0].id)
+    photos = [row[0] for row in photos]
+
+    pagination = {"next_cursor": next_cursor, "per_page": per_page, "seed": seed}
+    if request.args.get('include_total', '0').lower() in ('1', 'true') and not cursor:
+        pagination["total"] = count_total(base_query)
+    return photos, pagination
+
+def is_first_page():
+    """Only first pages are cached; deeper pages are rarely revisited and an unseeded shuffle never repeats."""
+    if request.args.get('order', '').lower() == 'random' and not request.args.get('seed'):
+        return False
+    return request.args.get('page', '1') == '1' and not request.args.get('cursor')
+
+@cached_response('photos', 'albums', when=is_first_page)
 def get_photo_list():
     try:
         # Query parameters
@@ -12,61 +256,136 @@ def get_photo_list():
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 20))
 
+        fields = get_fields()
+
         # Base query
-        query = Photo.query
+        query = Photo.query.options(*photo_query_options(fields))
 
-        # Apply ordering
-        if order == 'new-to-old':
-            query = query.order_by(desc(Photo.creation_date))
-        elif order == 'old-to-new':
-            query = query.order_by(Photo.creation_date)
-        elif order == 'a-z':
-            query = query.order_by(Photo.filename)
-        elif order == 'z-a':
-            query = query.order_by(desc(Photo.filename))
-        elif order == 'random':
-            query = query.order_by(func.random())
-
-        # Apply pagination
-        paginated_photos = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Apply ordering and pagination (keyset when a cursor is given)
+        photos, pagination = paginate_photos(query, order, page, per_page)
 
         # Format response
-        photo_list = [
-            {
-                "id": photo.id,
-                "filename": photo.filename,
-                "filepath": photo.filepath,
-                "folderpath": photo.folder_path,
-                "thumbnail_url": f"/pic/thumbnail/{photo.thumbnail_path.split('/')[-1]}" if photo.thumbnail_path else None,  # Hosted URL
-                "photo_url": f"/pic/photos/{photo.filepath.replace('/Photos/', '')}" if photo.filepath else None,  # Hosted URL
-                "creation_date": photo.creation_date.isoformat() if photo.creation_date else None,
-                "gps_latitude": photo.gps_latitude,
-                "gps_longitude": photo.gps_longitude,
-                "camera_model": photo.camera_model,
-                "focal_length": photo.focal_length,
-                "lens_model": photo.lens_model,
-                "album": {
-                    "id": photo.album.id,
-                    "name": photo.album.name,
-                    "creation_date": photo.album.creation_date.isoformat()
-                } if photo.album else None,
-            }
-            for photo in paginated_photos.items
-        ]
+        photo_list = [serialize_photo(photo, fields) for photo in photos]
 
         # Return JSON response
-        return jsonify({
-            "photos": photo_list,
-            "total": paginated_photos.total,
-            "page": paginated_photos.page,
-            "pages": paginated_photos.pages,
-            "per_page": paginated_photos.per_page,
-        }), 200
+        return jsonify({"photos": photo_list, **pagination}), 200
 
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error in /photo/list: {str(e)}")
         return jsonify({"message": "An error occurred while fetching the photo list.", "error": str(e)}), 500
 
+class InvalidFilter(ValueError):
+    """A search filter value that does not parse."""
+
+def in_albums(album_ids):
+    return Photo.id.in_(db.select(AlbumPhoto.photo_id).where(AlbumPhoto.album_id.in_(album_ids)))
+
+# Multi-valued search filters: parameter -> (facet dimension, condition for a list of values, value type)
+SEARCH_FILTERS = {
+    'camera': ('camera', Photo.camera_model.in_, str),
+    'lens': ('lens', Photo.lens_model.in_, str),
+    'folder': ('folder', Photo.folder_path.in_, str),
+    'album_id': ('album', in_albums, int),
+    'cluster_id': ('gps_cluster', Photo.gps_cluster_id.in_, int),
+}
+
+def parse_date(value, end=False):
+    """ISO date or datetime; a bare date as end of a range covers that whole day."""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilter(f"Invalid date: {value}")
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def get_search_conditions():
+    """Filter conditions of a search request, keyed by the facet dimension they narrow."""
+    conditions = {}
+    for param, (dimension, condition, value_type) in SEARCH_FILTERS.items():
+        values = request.args.getlist(param)
+        if values:
+            try:
+                conditions[dimension] = condition([value_type(value) for value in values])
+            except ValueError:
+                raise InvalidFilter(f"Invalid {param} value")
+
+    focal_range = []
+    try:
+        if request.args.get('focal_min'):
+            focal_range.append(Photo.focal_length >= float(request.args['focal_min']))
+        if request.args.get('focal_max'):
+            focal_range.append(Photo.focal_length <= float(request.args['focal_max']))
+    except ValueError:
+        raise InvalidFilter("Invalid focal length range")
+    if focal_range:
+        conditions['focal_length'] = and_(*focal_range)
+
+    date_range = []
+    if request.args.get('date_from'):
+        date_range.append(Photo.creation_date >= parse_date(request.args['date_from']))
+    if request.args.get('date_to'):
+        date_range.append(Photo.creation_date < parse_date(request.args['date_to'], end=True))
+    if date_range:
+        conditions['year'] = and_(*date_range)
+    return conditions
+
+@cached_response('photos', 'albums', when=is_first_page)
+def search_photos():
+    """Photos matching every given filter, with facet counts for narrowing the search further.
+
+    q is a full-text query over filename, folder, camera, lens and album name (every word
+    as a prefix), ordered by relevance by default. Filters: camera, lens, folder, album_id
+    and cluster_id (repeatable, any of the values), focal_min/focal_max and date_from/date_to
+    (ISO dates, inclusive). Ordering, pagination and fields= work as in /photo/list;
+    facets=0 leaves out the facet counts.
+    """
+    try:
+        # Query parameters
+        order = request.args.get('order', 'relevance' if request.args.get('q', '').strip() else 'new-to-old').lower()
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 20))
+
+        fields = get_fields()
+        conditions = get_search_conditions()
+
+        # Full-text query, ranked by relevance unless another order is asked for
+        text = request.args.get('q', '').strip()
+        if text:
+            try:
+                matches = ranked_matches(text)
+            except ValueError as e:
+                raise InvalidFilter(str(e))
+            conditions['text'] = Photo.id.in_(db.select(matches.c.id))
+
+        # Base query
+        query = Photo.query.options(*photo_query_options(fields)).filter(*conditions.values())
+
+        # Apply ordering and pagination (keyset when a cursor is given)
+        if order == 'relevance':
+            if not text:
+                raise InvalidFilter("order=relevance requires q")
+            if 'cursor' in request.args:
+                raise InvalidCursor("Cursor pagination is not available for order=relevance")
+            query = query.join(matches, matches.c.id == Photo.id).order_by(matches.c.score, Photo.id)
+            photos, pagination = paginate_offset(query, page, per_page)
+        else:
+            photos, pagination = paginate_photos(query, order, page, per_page)
+
+        response = {"photos": [serialize_photo(photo, fields) for photo in photos], **pagination}
+        if request.args.get('facets', '1').lower() not in ('0', 'false'):
+            response["facets"] = facet_counts(conditions)
+        return jsonify(response), 200
+
+    except (InvalidCursor, InvalidFields, InvalidFilter) as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in /photo/search: {str(e)}")
+        return jsonify({"message": "An error occurred while searching photos.", "error": str(e)}), 500
+
+@cached_response('photos', 'albums', when=is_first_page)
 def get_album_photo_list():
     try:
         # Query parameters
@@ -78,60 +397,164 @@ def get_album_photo_list():
         if not album_id:
             return jsonify({"message": "album_id is required"}), 400
 
+        fields = get_fields()
+
         # Base query
-        query = Photo.query.filter(Photo.album_id == album_id)
+        query = Photo.query.options(*photo_query_options(fields)).join(
+            AlbumPhoto, AlbumPhoto.photo_id == Photo.id
+        ).filter(AlbumPhoto.album_id == album_id)
 
-        # Apply ordering
-        if order == 'new-to-old':
-            query = query.order_by(desc(Photo.creation_date))
-        elif order == 'old-to-new':
-            query = query.order_by(Photo.creation_date)
-        elif order == 'a-z':
-            query = query.order_by(Photo.filename)
-        elif order == 'z-a':
-            query = query.order_by(desc(Photo.filename))
-        elif order == 'random':
-            query = query.order_by(func.random())
-
-        # Apply pagination
-        paginated_photos = query.paginate(page=page, per_page=per_page, error_out=False)
+        # Apply ordering and pagination (keyset when a cursor is given)
+        photos, pagination = paginate_photos(query, order, page, per_page)
 
         # Format response
-        photo_list = [
+        photo_list = [serialize_photo(photo, fields) for photo in photos]
+
+        # Return JSON response
+        return jsonify({"photos": photo_list, **pagination}), 200
+
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in /photo/list: {str(e)}")
+        return jsonify({"message": "An error occurred while fetching the photo list.", "error": str(e)}), 500
+
+def iso(value):
+    return value.isoformat() if value else None
+
+@cached_response('folders', 'photos')
+def get_subfolder_list():
+    """Subfolders of path from the folders table, with their subtree counts, date range and cover."""
+    base_path = request.args.get('path', ROOT_FOLDER).rstrip('/')  # Default to '/Photos', strip trailing slash
+    try:
+        folder = get_folder(base_path)
+        if folder is None:
+            # The table is filled by the first index run
+            if base_path == ROOT_FOLDER:
+                return jsonify({"path": base_path, "subfolders": []}), 200
+            return jsonify({"error": "Invalid directory"}), 400
+
+        cover = aliased(Photo)
+        rows = db.session.query(Folder, cover.thumbnail_path).outerjoin(
+            cover, cover.id == Folder.cover_photo_id
+        ).filter(Folder.parent_id == folder.id).order_by(Folder.name).all()
+        subfolders = [
             {
-                "id": photo.id,
-                "filename": photo.filename,
-                "filepath": photo.filepath,
-                "folderpath": photo.folder_path,
-                "thumbnail_url": f"/pic/thumbnail/{photo.thumbnail_path.split('/')[-1]}" if photo.thumbnail_path else None,  # Hosted URL
-                "photo_url": f"/pic/photos/{photo.filepath.replace('/Photos/', '')}" if photo.filepath else None,  # Hosted URL
-                "creation_date": photo.creation_date.isoformat() if photo.creation_date else None,
-                "gps_latitude": photo.gps_latitude,
-                "gps_longitude": photo.gps_longitude,
-                "camera_model": photo.camera_model,
-                "focal_length": photo.focal_length,
-                "lens_model": photo.lens_model,
-                "album": {
-                    "id": photo.album.id,
-                    "name": photo.album.name,  # Correctly access the `name` attribute
-                    "creation_date": photo.album.creation_date.isoformat()
-                } if photo.album else None,
+                "name": subfolder.name,
+                "path": subfolder.path,
+                "creation_date": iso(subfolder.created_at),
+                "photo_count": subfolder.photo_count,
+                "total_count": subfolder.total_count,
+                "first_date": iso(subfolder.first_date),
+                "last_date": iso(subfolder.last_date),
+                "cover_thumbnail_url": get_thumbnail_url(thumbnail_path),
             }
-            for photo in paginated_photos.items
+            for subfolder, thumbnail_path in rows
         ]
+        return jsonify({
+            "path": base_path,
+            "photo_count": folder.photo_count,
+            "total_count": folder.total_count,
+            "subfolders": subfolders,
+        }), 200
+    except Exception as e:
+        current_app.logger.error(f"Error listing subfolders in {base_path}: {str(e)}")
+        return jsonify({"error": "Unable to fetch subfolders", "message": str(e)}), 500
 
-        # Return JSON response
+@cached_response('photos', 'albums', 'folders', when=is_first_page)
+def get_folder_photo_list():
+    """Photos of a folder, or of its whole subtree with recursive=1 (an index range on folder_path).
+
+    Ordering and pagination work as in /photo/list, cursors included. Pagination is
+    opt-in (page, per_page or cursor) so that clients expecting every photo keep working.
+    """
+    folder_path = request.args.get('path', ROOT_FOLDER).rstrip('/')  # Default to '/Photos', strip trailing slash
+    recursive = request.args.get('recursive', '0').lower() in ('1', 'true')
+    try:
+        order = request.args.get('order', 'new-to-old').lower()
+        page = int(request.args.get('page', 1))
+        per_page = int(request.args.get('per_page', 50))
+
+        # Ensure the folder is known to the index
+        if get_folder(folder_path) is None:
+            return jsonify({"error": "Invalid folder path"}), 400
+
+        fields = get_fields(FOLDER_PHOTO_FIELDS)
+        query = Photo.query.options(*photo_query_options(fields))
+        if recursive:
+            query = query.filter(subtree_condition(Photo.folder_path, folder_path))
+        else:
+            query = query.filter(Photo.folder_path == folder_path)
+
+        if any(name in request.args for name in ('page', 'per_page', 'cursor')):
+            photos, pagination = paginate_photos(query, order, page, per_page)
+        else:
+            photos, pagination = order_photos(query, order).all(), {}
+        photo_list = [serialize_photo(photo, fields) for photo in photos]
+        return jsonify({"path": folder_path, "recursive": recursive, "photos": photo_list, **pagination}), 200
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error listing photos in folder {folder_path}: {str(e)}")
+        return jsonify({"error": "Unable to fetch photos", "message": str(e)}), 500
+
+@cached_response('albums', 'photos')
+def get_album_list():
+    try:
+        # One aggregate over the photos of every album: count and cover (lowest photo id)
+        stats = db.session.query(
+            AlbumPhoto.album_id,
+            func.count(AlbumPhoto.photo_id).label('photo_count'),
+            func.min(AlbumPhoto.photo_id).label('cover_id'),
+        ).group_by(AlbumPhoto.album_id).subquery()
+        cover = aliased(Photo)
+
+        query = db.session.query(
+            Album,
+            func.coalesce(stats.c.photo_count, 0),
+            cover.thumbnail_path,
+        ).outerjoin(stats, stats.c.album_id == Album.id).outerjoin(cover, cover.id == stats.c.cover_id).order_by(Album.id)
+
+        # Pagination is opt-in so that clients expecting the plain list keep working
+        paginated = None
+        if 'page' in request.args or 'per_page' in request.args:
+            page = int(request.args.get('page', 1))
+            per_page = int(request.args.get('per_page', 50))
+            paginated = query.paginate(page=page, per_page=per_page, error_out=False)
+            rows = paginated.items
+        else:
+            rows = query.all()
+
+        album_list = [
+            {
+                "id": album.id,
+                "name": album.name,
+                "description": album.description,
+                "creation_date": album.creation_date.isoformat(),
+                "photo_count": photo_count,  # Count photos in the album
+                "thumbnail_url": get_thumbnail_url(thumbnail_path),  # Address of the first photo's thumbnail or None
+            }
+            for album, photo_count, thumbnail_path in rows
+        ]
+
+        if paginated is None:
+            return jsonify(album_list), 200
         return jsonify({
-            "photos": photo_list,
-            "total": paginated_photos.total,
-            "page": paginated_photos.page,
-            "pages": paginated_photos.pages,
-            "per_page": paginated_photos.per_page,
+            "albums": album_list,
+            "total": paginated.total,
+            "page": paginated.page,
+            "pages": paginated.pages,
+            "per_page": paginated.per_page,
         }), 200
 
     except Exception as e:
-        current_app.logger.error(f"Error in /photo/list: {str(e)}")
-        return jsonify({"message": "An error occurred while fetching the photo list.", "error": str(e)}), 500
+        current_app.logger.error(f"Error in /albums: {str(e)}")
+        return jsonify({"message": "An error occurred while fetching the album list.", "error": str(e)}), 500
+
+def refresh_album_rollups(album_id):
+    """After a membership change: recount the album's timeline days and facet count; the commit is left to the caller."""
+    refresh_timeline_album(album_id)
+    refresh_facet_values('album', [album_id])
 
 def get_album_action():
     try:
@@ -158,6 +581,7 @@ def get_album_action():
             new_album = Album(name=album_name)
             db.session.add(new_album)
             db.session.commit()
+            query_cache.invalidate('albums')
             return jsonify({"message": f"Album '{album_name}' added successfully", "album_id": new_album.id}), 200
 
         # Handle 'delete' action
@@ -170,9 +594,12 @@ def get_album_action():
             if not album:
                 return jsonify({"message": f"Album with ID '{album_id}' not found"}), 404
 
-            # Delete the album
+            # Delete the album and its memberships
+            db.session.execute(db.delete(AlbumPhoto).where(AlbumPhoto.album_id == album_id))
             db.session.delete(album)
+            refresh_album_rollups(album_id)
             db.session.commit()
+            query_cache.invalidate('albums')
             return jsonify({"message": f"Album with ID '{album_id}' deleted successfully"}), 200
 
         # Invalid action
@@ -204,21 +631,101 @@ def add_delete_from_album():
             return jsonify({"message": f"Photo with id {photo_id} not found"}), 404
 
         # Check if the photo is already in the album
-        if photo in album.photos:
+        membership = db.session.get(AlbumPhoto, (album_id, photo_id))
+        if membership:
             # Remove the photo from the album
-            photo.album_id = None
+            db.session.delete(membership)
+            db.session.flush()
+            refresh_album_rollups(album_id)
             db.session.commit()
+            query_cache.invalidate('albums')
             return jsonify({"message": f"Photo {photo_id} removed from album {album_id}"}), 200
         else:
             # Add the photo to the album
-            photo.album_id = album_id
+            db.session.add(AlbumPhoto(album_id=album_id, photo_id=photo_id))
+            db.session.flush()
+            refresh_album_rollups(album_id)
             db.session.commit()
+            query_cache.invalidate('albums')
             return jsonify({"message": f"Photo {photo_id} added to album {album_id}"}), 200
 
     except Exception as e:
+        db.session.rollback()
         current_app.logger.error(f"Error in /album/photo/action: {str(e)}")
         return jsonify({"message": "An error occurred while performing the album photo action.", "error": str(e)}), 500
     
+# Most photo ids accepted by one batch request
+MAX_BATCH_PHOTOS = 10000
+
+def update_album_photos():
+    """Add or remove many photos to or from an album in one set-based statement and one transaction.
+
+    JSON body: album_id, action ('add' or 'remove') and photo_ids. Without photo_ids the
+    photos matching the /photo/search filters of the query string are used, which must
+    name at least one filter.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        album_id = data.get('album_id')
+        action = str(data.get('action', '')).lower()
+        photo_ids = data.get('photo_ids')
+
+        if not isinstance(album_id, int) or action not in ('add', 'remove'):
+            return jsonify({"message": "album_id and an action of 'add' or 'remove' are required"}), 400
+        if not db.session.get(Album, album_id):
+            return jsonify({"message": f"Album with id {album_id} not found"}), 404
+
+        if photo_ids is not None:
+            if not isinstance(photo_ids, list) or not all(isinstance(photo_id, int) for photo_id in photo_ids):
+                return jsonify({"message": "photo_ids must be a list of integers"}), 400
+            if len(photo_ids) > MAX_BATCH_PHOTOS:
+                return jsonify({"message": f"At most {MAX_BATCH_PHOTOS} photo_ids per request"}), 400
+            selected = Photo.id.in_(photo_ids)
+        else:
+            conditions = list(get_search_conditions().values())
+            text = request.args.get('q', '').strip()
+            if text:
+                try:
+                    matches = ranked_matches(text)
+                except ValueError as e:
+                    raise InvalidFilter(str(e))
+                conditions.append(Photo.id.in_(db.select(matches.c.id)))
+            if not conditions:
+                return jsonify({"message": "photo_ids or at least one search filter is required"}), 400
+            selected = and_(*conditions)
+
+        membership = db.select(AlbumPhoto.photo_id).where(AlbumPhoto.album_id == album_id)
+        if action == 'add':
+            result = db.session.execute(
+                db.insert(AlbumPhoto).from_select(
+                    ["album_id", "photo_id", "added_at"],
+                    db.select(db.literal(album_id), Photo.id, db.literal(datetime.utcnow()))
+                    .where(selected, Photo.id.notin_(membership)),
+                )
+            )
+        else:
+            result = db.session.execute(
+                db.delete(AlbumPhoto).where(
+                    AlbumPhoto.album_id == album_id,
+                    AlbumPhoto.photo_id.in_(db.select(Photo.id).where(selected)),
+                )
+            )
+
+        # The membership change and the album's rollups commit together
+        refresh_album_rollups(album_id)
+        db.session.commit()
+        query_cache.invalidate('albums')
+        return jsonify({"album_id": album_id, "action": action, "changed": result.rowcount}), 200
+
+    except InvalidFilter as e:
+        db.session.rollback()
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error in /album/photos/batch: {str(e)}")
+        return jsonify({"message": "An error occurred while updating the album.", "error": str(e)}), 500
+
+@cached_response('photos', 'albums', 'clusters', when=lambda: request.args.get('action') == 'list' or is_first_page())
 def get_exif():
     try:
         # Query parameters from the request
@@ -273,8 +780,10 @@ def get_exif():
             return jsonify({"exif_type": exif_type, "values": formatted_values}), 200
 
         elif action == 'photo':
+            fields = get_fields()
+
             # Base query
-            query = Photo.query
+            query = Photo.query.options(*photo_query_options(fields))
 
             # Apply filter based on exif_type and value
             if exif_type == 'lens':
@@ -303,57 +812,227 @@ def get_exif():
                 except ValueError:
                     return jsonify({"message": "Invalid cluster_id value"}), 400
 
-            # Apply ordering
-            if order == 'new-to-old':
-                query = query.order_by(desc(Photo.creation_date))
-            elif order == 'old-to-new':
-                query = query.order_by(Photo.creation_date)
-            elif order == 'a-z':
-                query = query.order_by(Photo.filename)
-            elif order == 'z-a':
-                query = query.order_by(desc(Photo.filename))
-            elif order == 'random':
-                query = query.order_by(func.random())
-
-            # Apply pagination
-            paginated_photos = query.paginate(page=page, per_page=per_page, error_out=False)
+            # Apply ordering and pagination (keyset when a cursor is given)
+            photos, pagination = paginate_photos(query, order, page, per_page)
 
             # Format response
-            photo_list = [
-                {
-                    "id": photo.id,
-                    "filename": photo.filename,
-                    "filepath": photo.filepath,
-                    "folderpath": photo.folder_path,
-                    "thumbnail_url": f"/pic/thumbnail/{photo.thumbnail_path.split('/')[-1]}" if photo.thumbnail_path else None,
-                    "photo_url": f"/pic/photos/{photo.filepath.replace('/Photos/', '')}" if photo.filepath else None,
-                    "creation_date": photo.creation_date.isoformat() if photo.creation_date else None,
-                    "gps_latitude": photo.gps_latitude,
-                    "gps_longitude": photo.gps_longitude,
-                    "camera_model": photo.camera_model,
-                    "focal_length": photo.focal_length,
-                    "lens_model": photo.lens_model,
-                    "album": {
-                        "id": photo.album.id,
-                        "name": photo.album.name,
-                        "creation_date": photo.album.creation_date.isoformat()
-                    } if photo.album else None,
-                }
-                for photo in paginated_photos.items
-            ]
+            photo_list = [serialize_photo(photo, fields) for photo in photos]
 
             # Return JSON response
-            return jsonify({
-                "photos": photo_list,
-                "total": paginated_photos.total,
-                "page": paginated_photos.page,
-                "pages": paginated_photos.pages,
-                "per_page": paginated_photos.per_page,
-            }), 200
+            return jsonify({"photos": photo_list, **pagination}), 200
 
         else:
             return jsonify({"message": f"Invalid action: {action}"}), 400
 
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({"message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error in get_exif: {str(e)}")
         return jsonify({"message": "An error occurred while fetching the photo exif data.", "error": str(e)}), 500
+
+# Length of the ISO date prefix that names a bucket of each granularity
+TIMELINE_GRANULARITIES = {'year': 4, 'month': 7, 'day': 10}
+
+# Timeline filters: parameter -> rollup dimension
+TIMELINE_FILTERS = {'album_id': 'album', 'folder': 'folder', 'camera': 'camera'}
+
+def get_timeline_days():
+    """(day, count) rows for the album_id, folder and camera filters of the request.
+
+    One filter (or none) is read from the rollup table; combined filters are counted from
+    photos with a GROUP BY per day, cached until photos or albums change.
+    """
+    given = {param: request.args[param] for param in TIMELINE_FILTERS if request.args.get(param)}
+    if 'album_id' in given and not given['album_id'].isdigit():
+        raise InvalidFilter("Invalid album_id value")
+    if len(given) <= 1:
+        param, value = next(iter(given.items()), (None, ''))
+        return day_counts(TIMELINE_FILTERS.get(param, 'all'), value)
+
+    conditions = [Photo.creation_date.isnot(None)]
+    if 'album_id' in given:
+        conditions.append(in_albums([int(given['album_id'])]))
+    if 'folder' in given:
+        conditions.append(Photo.folder_path == given['folder'])
+    if 'camera' in given:
+        conditions.append(Photo.camera_model == given['camera'])
+
+    def count_days():
+        day = func.date(Photo.creation_date)
+        rows = db.session.query(day, func.count(Photo.id)).filter(*conditions).group_by(day).order_by(day).all()
+        # SQLite returns date() as text
+        return [(value if isinstance(value, date) else date.fromisoformat(value), count) for value, count in rows]
+    return query_cache.get_or_compute(f"timeline:{sorted(given.items())}", ('photos', 'albums'), count_days)
+
+@cached_response('photos', 'albums')
+def get_timeline():
+    """Photo counts per year, month or day for the timeline scrubber, optionally within date_from/date_to."""
+    try:
+        granularity = request.args.get('granularity', 'month').lower()
+        if granularity not in TIMELINE_GRANULARITIES:
+            return jsonify({"message": "granularity must be year, month or day"}), 400
+        prefix = TIMELINE_GRANULARITIES[granularity]
+        date_from = parse_date(request.args['date_from']).date() if request.args.get('date_from') else None
+        date_to = parse_date(request.args['date_to']).date() if request.args.get('date_to') else None
+
+        buckets = {}
+        for day, count in get_timeline_days():
+            if (date_from and day < date_from) or (date_to and day > date_to):
+                continue
+            bucket = day.isoformat()[:prefix]
+            buckets[bucket] = buckets.get(bucket, 0) + count
+
+        return jsonify({
+            "granularity": granularity,
+            "buckets": [{"date": bucket, "count": count} for bucket, count in buckets.items()],
+            "total": sum(buckets.values()),
+        }), 200
+
+    except InvalidFilter as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in /photo/timeline: {str(e)}")
+        return jsonify({"message": "An error occurred while fetching the timeline.", "error": str(e)}), 500
+
+def parse_period(value):
+    """First day and the day after the last day of a YYYY, YYYY-MM or YYYY-MM-DD period."""
+    try:
+        parts = [int(part) for part in value.split('-')]
+        if len(parts) == 1:
+            return date(parts[0], 1, 1), date(parts[0] + 1, 1, 1)
+        if len(parts) == 2:
+            start = date(parts[0], parts[1], 1)
+            return start, (start + timedelta(days=31)).replace(day=1)
+        if len(parts) == 3:
+            start = date(*parts)
+            return start, start + timedelta(days=1)
+    except ValueError:
+        pass
+    raise InvalidFilter(f"Invalid date: {value}")
+
+def get_timeline_jump():
+    """Where a date starts in a date-ordered photo list: a cursor for /photo/list (or
+    /album/photos, /photo/search with the same filters) and the number of photos before it.
+
+    With order=new-to-old the cursor lands on the last photo of the period, with
+    old-to-new on its first. Photos without a date are not counted in the position.
+    """
+    try:
+        value = request.args.get('date')
+        order = request.args.get('order', 'new-to-old').lower()
+        per_page = int(request.args.get('per_page', 20))
+        if not value:
+            return jsonify({"message": "date is required"}), 400
+        if order not in ('new-to-old', 'old-to-new'):
+            return jsonify({"message": "order must be new-to-old or old-to-new"}), 400
+        start, end = parse_period(value)
+
+        days = get_timeline_days()
+        if order == 'new-to-old':
+            # After (end of period, id 0) in descending order: everything before the period ends
+            boundary = datetime.combine(end, datetime.min.time())
+            position = sum(count for day, count in days if day >= end)
+        else:
+            boundary = datetime.combine(start, datetime.min.time())
+            position = sum(count for day, count in days if day < start)
+
+        return jsonify({
+            "date": value,
+            "order": order,
+            "cursor": encode_cursor(order, boundary, 0),
+            "position": position,
+            "page": position // per_page + 1,
+            "per_page": per_page,
+        }), 200
+
+    except InvalidFilter as e:
+        return jsonify({"message": str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error in /photo/timeline/jump: {str(e)}")
+        return jsonify({"message": "An error occurred while looking up the date.", "error": str(e)}), 500
+
+# From this zoom level on, the map shows single photos instead of clusters
+PHOTO_ZOOM = 17
+
+def in_viewport(latitude, longitude, west, south, east, north):
+    conditions = [latitude.between(south, north)]
+    if west <= east:
+        conditions.append(longitude.between(west, east))
+    else:
+        # The viewport crosses the antimeridian
+        conditions.append(or_(longitude >= west, longitude <= east))
+    return conditions
+
+@cached_response('photos', 'clusters')
+def get_geo_clusters():
+    try:
+        # Query parameters: bbox=west,south,east,north and the map zoom level
+        bbox = request.args.get('bbox')
+        zoom = request.args.get('zoom', type=int)
+        try:
+            limit = min(int(request.args.get('limit', 500)), 5000)
+        except ValueError:
+            return jsonify({"message": "limit must be an integer"}), 400
+
+        if not bbox or zoom is None:
+            return jsonify({"message": "bbox and zoom are required"}), 400
+        try:
+            west, south, east, north = (float(value) for value in bbox.split(','))
+        except ValueError:
+            return jsonify({"message": "bbox must be west,south,east,north"}), 400
+
+        if zoom >= PHOTO_ZOOM:
+            # Viewport filter, served by the (gps_latitude, gps_longitude) index; newest photos first
+            photos = (
+                db.session.query(Photo.id, Photo.gps_latitude, Photo.gps_longitude, Photo.thumbnail_path)
+                .filter(*in_viewport(Photo.gps_latitude, Photo.gps_longitude, west, south, east, north))
+                .order_by(desc(Photo.creation_date), desc(Photo.id))
+                .limit(limit)
+                .all()
+            )
+            return jsonify({
+                "zoom": zoom,
+                "photos": [
+                    {
+                        "id": photo.id,
+                        "latitude": photo.gps_latitude,
+                        "longitude": photo.gps_longitude,
+                        "thumbnail_url": get_thumbnail_url(photo.thumbnail_path),
+                    }
+                    for photo in photos
+                ],
+            }), 200
+
+        # Precomputed geohash cells; the prefix length grows with the zoom level.
+        # The largest clusters are kept when the viewport holds more than limit
+        precision = geohash.precision_for_zoom(zoom)
+        cover = aliased(Photo)
+        clusters = (
+            db.session.query(GeoCell, cover.thumbnail_path)
+            .outerjoin(cover, cover.id == GeoCell.cover_photo_id)
+            .filter(GeoCell.precision == precision,
+                    *in_viewport(GeoCell.latitude, GeoCell.longitude, west, south, east, north))
+            .order_by(desc(GeoCell.photo_count), GeoCell.geohash)
+            .limit(limit)
+            .all()
+        )
+
+        return jsonify({
+            "zoom": zoom,
+            "precision": precision,
+            "clusters": [
+                {
+                    "geohash": cluster.geohash,
+                    "photo_count": cluster.photo_count,
+                    "latitude": cluster.latitude,
+                    "longitude": cluster.longitude,
+                    "cover_photo_id": cluster.cover_photo_id,
+                    "thumbnail_url": get_thumbnail_url(thumbnail_path),
+                }
+                for cluster, thumbnail_path in clusters
+            ],
+        }), 200
+
+    except Exception as e:
+        current_app.logger.error(f"Error in /photo/geo: {str(e)}")
+        return jsonify({"message": "An error occurred while fetching the map clusters.", "error": str(e)}), 500
@@ -0,0 +1,294 @@
+import os
+import math
+import shutil
+import logging
+import threading
+from PIL import Image, ImageOps
+
+# Longest-edge sizes offered by /pic/rendition, the ones built while indexing, and the
+# byte budget of the on-disk LRU cache holding the lazily built ones
+RENDITION_SIZES = [int(size) for size in os.getenv("RENDITION_SIZES", "150,300,1024,2048").split(',')]
+EAGER_RENDITION_SIZES = [int(size) for size in os.getenv("EAGER_RENDITION_SIZES", "150,300").split(',')]
+RENDITION_CACHE_BYTES = int(os.getenv("RENDITION_CACHE_MB", 2048)) * 1024 * 1024
+
+# /pic/render: largest side it produces, and decodes running at once per worker process,
+# which bounds the memory a burst of requests for new renditions can take
+RENDER_MAX_SIZE = int(os.getenv("RENDER_MAX_SIZE", 4096))
+RENDER_DECODES = int(os.getenv("RENDER_DECODES", os.cpu_count() or 2))
+FITS = ('contain', 'cover')  # Inside the w x h box, or filling it with the overflow cropped
+
+THUMBNAIL_DIR = "/Photos/thumbnail"
+CACHE_DIR = os.path.join(THUMBNAIL_DIR, "cache")
+
+# format name -> (Pillow format, mimetype, extension, save options)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg', {'quality': 85}),
+}
+
+def choose_format(accept_mimetypes, requested=None):
+    """Pick the rendition format: an explicit fmt= wins, else WebP when the client lists
+    image/webp itself in Accept (request.accept_mimetypes) with q > 0, else JPEG. Wildcards
+    such as */* or image/* do not count, as clients sending only those may not decode WebP."""
+    if requested in FORMATS:
+        return requested
+    listed = any(value.lower() == 'image/webp' for value in accept_mimetypes.values())
+    if listed and accept_mimetypes['image/webp'] > 0:
+        return 'webp'
+    return 'jpeg'
+
+def shard(content_hash, extension):
+    return os.path.join(content_hash[:2], content_hash[2:4], f"{content_hash}.{extension}")
+
+def get_rendition_path(content_hash, size, fmt):
+    """Where a rendition lives: the 300px JPEG is the indexer's thumbnail, the other eager
+    sizes sit next to it under thumbnail/<size>/, lazy sizes in the evictable cache."""
+    extension = FORMATS[fmt][2]
+    if size == 300 and fmt == 'jpeg':
+        return os.path.join(THUMBNAIL_DIR, shard(content_hash, extension))
+    if size in EAGER_RENDITION_SIZES:
+        return os.path.join(THUMBNAIL_DIR, str(size), shard(content_hash, extension))
+    return os.path.join(CACHE_DIR, str(size), shard(content_hash, extension))
+
+def prepare_image(img, size, orientation=None):
+    """Decode img at reduced resolution, fit it in size x size and apply the EXIF orientation."""
+    # Let the JPEG decoder scale down by 1/2..1/8 (DCT scaling) instead of decoding
+    # the full resolution; keep twice the target size so the resize still looks sharp
+    img.draft('RGB', (size * 2, size * 2))
+
+    # Convert to RGB if necessary
+    if img.mode in ('RGBA', 'P', 'LA', 'I;16', 'CMYK'):
+        img = img.convert('RGB')
+
+    img.thumbnail((size, size))
+
+    # Correct orientation on the small image
+    return apply_orientation(img, orientation)
+
+def apply_orientation(img, orientation):
+    if orientation == 3:
+        img = img.rotate(180, expand=True)
+    elif orientation == 6:
+        img = img.rotate(270, expand=True)
+    elif orientation == 8:
+        img = img.rotate(90, expand=True)
+    return img
+
+def render_box(width, height, fit):
+    """Validated (width, height, fit) of a render request; a missing side is bounded by RENDER_MAX_SIZE."""
+    fit = (fit or 'contain').lower()
+    if fit not in FITS:
+        raise ValueError(f"Invalid fit, use one of {FITS}")
+    try:
+        width = int(width) if width else None
+        height = int(height) if height else None
+    except ValueError:
+        raise ValueError("w and h must be integers")
+    if width is None and height is None:
+        raise ValueError("w or h is required")
+    if fit == 'cover' and (width is None or height is None):
+        raise ValueError("fit=cover requires both w and h")
+    if any(side is not None and not 1 <= side <= RENDER_MAX_SIZE for side in (width, height)):
+        raise ValueError(f"w and h must be between 1 and {RENDER_MAX_SIZE}")
+    return width or RENDER_MAX_SIZE, height or RENDER_MAX_SIZE, fit
+
+def render_image(img, width, height, fit, orientation=None):
+    """Decode img at the lowest resolution that still covers twice the output, then fit it in the box."""
+    upright = img.size[::-1] if orientation in (6, 8) else img.size
+    ratio = (min if fit == 'contain' else max)(width / upright[0], height / upright[1])
+    scale = 2 * min(ratio, 1)
+    img.draft('RGB', (math.ceil(img.size[0] * scale), math.ceil(img.size[1] * scale)))
+
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    img = apply_orientation(img, orientation)
+    if fit == 'cover':
+        # Never upscale: a box larger than the original shrinks to it, keeping its aspect ratio
+        shrink = min(1, upright[0] / width, upright[1] / height)
+        box = (max(1, round(width * shrink)), max(1, round(height * shrink)))
+        return ImageOps.fit(img, box, Image.LANCZOS)
+    img.thumbnail((width, height), Image.LANCZOS)
+    return img
+
+def save_image(img, path, fmt):
+    """Write under a temporary name and rename, so concurrent writers of the same key are safe."""
+    pil_format, _, _, options = FORMATS[fmt]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    img.save(temp_path, pil_format, **options)
+    os.replace(temp_path, path)
+    return path
+
+def save_eager_renditions(img, content_hash):
+    """Write the eager sizes that fit in an already prepared image, in every format.
+
+    Called by the indexer with its thumbnail image, so this never decodes the original again.
+    """
+    for size in sorted(EAGER_RENDITION_SIZES, reverse=True):
+        if size > max(img.size):
+            continue  # larger than what was decoded, built lazily on first request
+        resized = img.copy()
+        resized.thumbnail((size, size))
+        for fmt in FORMATS:
+            path = get_rendition_path(content_hash, size, fmt)
+            if size == 300 and fmt == 'jpeg' or os.path.exists(path):
+                continue
+            try:
+                save_image(resized, path, fmt)
+            except Exception as e:
+                logging.error(f"Failed to save {size}px {fmt} rendition of {content_hash}: {e}")
+
+def remove_renditions(content_hash):
+    """Delete every rendition and render of a content hash, once no photo uses that content anymore."""
+    for size in RENDITION_SIZES + [300]:
+        for fmt in FORMATS:
+            try:
+                os.remove(get_rendition_path(content_hash, size, fmt))
+            except OSError:
+                pass
+    # Renders of every box sit in one directory per content hash
+    shutil.rmtree(get_render_dir(content_hash), ignore_errors=True)
+
+class DiskCache:
+    """Byte-budgeted LRU over the files of one directory tree.
+
+    Recency is the file mtime, bumped on every hit, so it is shared by all worker
+    processes. The running total is counted once from disk and then tracked; when
+    it crosses the budget the least recently used files are removed down to 90%.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.total = None
+        self.lock = threading.Lock()
+
+    def files(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat
+
+    def touch(self, path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def added(self, path):
+        """Account for a file just written to the cache, evicting cold files when over budget."""
+        with self.lock:
+            if self.total is None:
+                self.total = sum(stat.st_size for _, stat in self.files())
+            else:
+                try:
+                    self.total += os.path.getsize(path)
+                except OSError:
+                    pass
+            if self.total > self.max_bytes:
+                self.evict(path)
+
+    def evict(self, keep):
+        target = self.max_bytes * 0.9
+        entries = sorted(self.files(), key=lambda entry: entry[1].st_mtime)
+        self.total = sum(stat.st_size for _, stat in entries)
+        for path, stat in entries:
+            if self.total <= target:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                self.total -= stat.st_size
+            except OSError:
+                pass
+
+rendition_cache = DiskCache(CACHE_DIR, RENDITION_CACHE_BYTES)
+
+class Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one; the other callers wait for its result.
+
+    Per process: workers of other processes may still build the same file, which
+    save_image makes harmless.
+    """
+
+    def __init__(self):
+        self.flights = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, compute):
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = compute()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+renders_in_flight = SingleFlight()
+decode_slots = threading.BoundedSemaphore(RENDER_DECODES)
+
+def build_once(photo, path, fmt, transform, lazy=True):
+    """Path of a rendition file, drawn from the original with transform(img, orientation) when missing.
+
+    Concurrent requests for the same file share one build, and builds wait for one of
+    the RENDER_DECODES decode slots. Lazy files are accounted in the evictable cache.
+    """
+    if os.path.exists(path):
+        if lazy:
+            rendition_cache.touch(path)
+        return path
+
+    def build():
+        if os.path.exists(path):
+            return path  # Built meanwhile by a flight that had just finished
+        with decode_slots:
+            with Image.open(photo.filepath) as img:
+                orientation = img.getexif().get(0x0112)  # Orientation
+                save_image(transform(img, orientation), path, fmt)
+        if lazy:
+            rendition_cache.added(path)
+        return path
+
+    return renders_in_flight.do(path, build)
+
+def get_rendition(photo, size, fmt):
+    """Path of a photo's rendition, rendering it from the original on first request."""
+    path = get_rendition_path(photo.content_hash, size, fmt)
+    return build_once(photo, path, fmt, lambda img, orientation: prepare_image(img, size, orientation),
+                      lazy=path.startswith(CACHE_DIR + os.sep))
+
+def get_render_dir(content_hash):
+    """Directory of all renders of a content hash, render/ab/cd/<hash>/, so a purge removes one directory."""
+    return os.path.join(CACHE_DIR, 'render', content_hash[:2], content_hash[2:4], content_hash)
+
+def get_render_path(content_hash, width, height, fit, fmt):
+    return os.path.join(get_render_dir(content_hash), f"{width}x{height}-{fit}.{FORMATS[fmt][2]}")
+
+def get_render(photo, width, height, fit, fmt):
+    """Path of a photo rendered to an arbitrary box, kept in the evictable cache."""
+    path = get_render_path(photo.content_hash, width, height, fit, fmt)
+    return build_once(photo, path, fmt, lambda img, orientation: render_image(img, width, height, fit, orientation))
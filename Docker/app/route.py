@@ -1,10 +1,14 @@
 # route.py
 from flask import Blueprint, request, jsonify, make_response, session, send_from_directory, current_app
 from flask_session import Session
-from app.indexer import PhotoIndexer
-from app.photolist import get_photo_list, get_album_photo_list, get_album_action, add_delete_from_album, get_exif
+from app.jobs import start_index_job, get_job, cancel_job, job_to_dict
+from app.photolist import get_photo_list, get_album_photo_list, get_album_action, add_delete_from_album, get_exif, get_geo_clusters
+from app.photolist import get_timeline, get_timeline_jump, update_album_photos, search_photos, get_album_list, get_folder_photo_list, get_subfolder_list
 from sqlalchemy import desc, func
 from app.db import db, Album, Photo
+from app.cache import query_cache
+from app.renditions import RENDITION_SIZES, FORMATS, choose_format, get_rendition, render_box, get_render
+from app.delivery import send_image, not_modified, hash_of
 from datetime import datetime
 import os
 
@@ -54,27 +58,62 @@ def protected():
 def index():
     """
     Route to start indexing the photo library.
+    Pass rescan=1 to also refresh changed files, follow moves and purge deleted files.
+    Indexing runs as a background job; the response carries its id right away.
     Only accessible to logged-in users with a valid session.
     """
     # Verify the user session
     if 'username' in session:
         try:
-            # Start the photo indexing process
-            PhotoIndexer.init_indexer()  # Triggers indexing manually
-            return jsonify({"message": "Indexing started successfully."}), 200
+            rescan = request.args.get('rescan', '0').lower() in ('1', 'true')
+            # Start the photo indexing job, unless one is already running
+            job, started = start_index_job(rescan=rescan)
+            if not started:
+                return jsonify({"message": "Indexing is already running.", "job_id": job.id if job else None}), 409
+            return jsonify({"message": "Indexing started successfully.", "job_id": job.id}), 202
         except Exception as e:
             # Log and return error details
             current_app.logger.error(f"Error during indexing: {str(e)}")
             return jsonify({"message": "Indexing failed", "error": str(e)}), 500
     else:
         return jsonify({"message": "Unauthorized access."}), 401
+
+@routes.route('/photo/index/status', methods=['GET'])
+def index_status():
+    """
+    Progress of an indexing job (files seen/processed/failed, throughput, ETA).
+    Defaults to the most recent job when job_id is not given.
+    """
+    if 'username' in session:
+        job = get_job(request.args.get('job_id', type=int))
+        if not job:
+            return jsonify({"message": "Indexing job not found"}), 404
+        return jsonify(job_to_dict(job)), 200
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
+
+@routes.route('/photo/index/cancel', methods=['POST'])
+def index_cancel():
+    """
+    Cancel an indexing job; it stops after the batch in progress.
+    Defaults to the most recent job when job_id is not given.
+    """
+    if 'username' in session:
+        try:
+            job = get_job(request.args.get('job_id', type=int))
+            if not job:
+                return jsonify({"message": "Indexing job not found"}), 404
+            return jsonify(job_to_dict(cancel_job(job))), 200
+        except Exception as e:
+            current_app.logger.error(f"Error cancelling indexing job: {str(e)}")
+            return jsonify({"message": "An error occurred while cancelling the indexing job.", "error": str(e)}), 500
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
     
 @routes.route('/photo/list', methods=['GET'])
 def photo_list():
     if 'username' in session:
-        stuff = get_photo_list()
-        print(stuff)
-        return stuff
+        return get_photo_list()
     else:
         #print("The session id is")
         return jsonify({"message": "Unauthorized"}), 401
@@ -87,7 +126,9 @@ def serve_thumbnail(filename):
     """
     if 'username' in session:
         try:
-            return send_from_directory(THUMBNAIL_DIR, filename, as_attachment=False)
+            # Content-addressed names never change content; legacy names are revalidated
+            content_hash = hash_of(filename)
+            return send_image(THUMBNAIL_DIR, filename, etag=content_hash, immutable=content_hash is not None)
         except FileNotFoundError:
             return jsonify({"message": "File not found"}), 404
     else:
@@ -96,14 +137,93 @@ def serve_thumbnail(filename):
     
 
 
+@routes.route('/pic/rendition/<int:size>/<content_hash>', methods=['GET'])
+def serve_rendition(size, content_hash):
+    """
+    Serve a photo resized to `size` px on its longest edge, as WebP when the client
+    accepts it (or when fmt=webp|jpeg asks for it), JPEG otherwise.
+    Small sizes are built while indexing, larger ones on first request.
+    """
+    if 'username' in session:
+        if size not in RENDITION_SIZES:
+            return jsonify({"message": f"Invalid size, use one of {RENDITION_SIZES}"}), 400
+        fmt = choose_format(request.accept_mimetypes, request.args.get('fmt'))
+        etag = f"{content_hash}-{size}-{fmt}"
+        response = not_modified(etag, immutable=True)
+        if response is not None:
+            response.vary.add('Accept')
+            return response
+        photo = Photo.query.filter_by(content_hash=content_hash).first()
+        if not photo:
+            return jsonify({"message": "File not found"}), 404
+        try:
+            path = get_rendition(photo, size, fmt)
+        except FileNotFoundError:
+            return jsonify({"message": "File not found"}), 404
+        except Exception as e:
+            current_app.logger.error(f"Error rendering {size}px rendition of {content_hash}: {str(e)}")
+            return jsonify({"message": "An error occurred while rendering the photo.", "error": str(e)}), 500
+        response = send_image(os.path.dirname(path), os.path.basename(path), etag=etag, immutable=True,
+                              mimetype=FORMATS[fmt][1])
+        response.vary.add('Accept')
+        return response
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
+
+@routes.route('/pic/render/<int:photo_id>', methods=['GET'])
+def serve_render(photo_id):
+    """
+    Serve a photo rendered on demand into a w x h box (either side may be omitted):
+    fit=contain (default) keeps it inside the box, fit=cover fills the box and crops.
+    The format follows fmt=webp|jpeg or the Accept header. Renders are cached on disk;
+    URLs carrying the photo's content hash as ?v= are immutable.
+    """
+    if 'username' in session:
+        try:
+            width, height, fit = render_box(request.args.get('w'), request.args.get('h'), request.args.get('fit'))
+        except ValueError as e:
+            return jsonify({"message": str(e)}), 400
+        photo = db.session.query(Photo.id, Photo.filepath, Photo.content_hash).filter(Photo.id == photo_id).first()
+        if not photo or not photo.content_hash:
+            return jsonify({"message": "File not found"}), 404
+        fmt = choose_format(request.accept_mimetypes, request.args.get('fmt'))
+        etag = f"{photo.content_hash}-{width}x{height}-{fit}-{fmt}"
+        immutable = request.args.get('v') == photo.content_hash
+        response = not_modified(etag, immutable)
+        if response is None:
+            try:
+                path = get_render(photo, width, height, fit, fmt)
+            except FileNotFoundError:
+                return jsonify({"message": "File not found"}), 404
+            except Exception as e:
+                current_app.logger.error(f"Error rendering photo {photo_id} at {width}x{height} {fit}: {str(e)}")
+                return jsonify({"message": "An error occurred while rendering the photo.", "error": str(e)}), 500
+            response = send_image(os.path.dirname(path), os.path.basename(path), etag=etag, immutable=immutable,
+                                  mimetype=FORMATS[fmt][1])
+        response.vary.add('Accept')
+        return response
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
+
 @routes.route('/pic/photos/<path:filename>', methods=['GET'])
 def serve_photo(filename):
     """
     Serve an actual photo from the photo directory.
+    The ETag is the content hash while the file still matches the indexed manifest;
+    URLs carrying that hash as ?v= are immutable.
     """
     if 'username' in session:
         try:
-            return send_from_directory(PHOTO_DIR, filename, as_attachment=False)
+            etag = None
+            photo = db.session.query(Photo.content_hash, Photo.file_size, Photo.file_mtime).filter(
+                Photo.filepath == os.path.join(PHOTO_DIR, filename)
+            ).first()
+            if photo and photo.content_hash:
+                stat = os.stat(os.path.join(PHOTO_DIR, filename))
+                if (stat.st_size, stat.st_mtime_ns) == (photo.file_size, photo.file_mtime):
+                    etag = photo.content_hash
+            immutable = etag is not None and request.args.get('v') == etag
+            return send_image(PHOTO_DIR, filename, etag=etag, immutable=immutable)
         except FileNotFoundError:
             return jsonify({"message": "File not found"}), 404
     else:
@@ -113,90 +233,29 @@ def serve_photo(filename):
 
 @routes.route('/folders', methods=['GET'])
 def list_subfolders():
-    base_path = request.args.get('path', '/Photos').rstrip('/')  # Default to '/Photos', strip trailing slash
-
     if 'username' in session:
-        try:
-            # Ensure the path is valid and inside the allowed base directory
-            if not os.path.exists(base_path) or not os.path.isdir(base_path):
-                return jsonify({"error": "Invalid directory"}), 400
-
-            subfolders = []
-            for name in os.listdir(base_path):
-                folder_path = os.path.join(base_path, name)
-                if os.path.isdir(folder_path):
-                    # Get the creation date of the folder
-                    creation_date = datetime.fromtimestamp(os.path.getctime(folder_path)).isoformat()
-                    subfolders.append({
-                        "name": name,
-                        "path": folder_path,
-                        "creation_date": creation_date
-                    })
-
-            return jsonify({"path": base_path, "subfolders": subfolders}), 200
-        except Exception as e:
-            current_app.logger.error(f"Error listing subfolders in {base_path}: {str(e)}")
-            return jsonify({"error": "Unable to fetch subfolders", "message": str(e)}), 500
+        return get_subfolder_list()
     else:
         return jsonify({"message": "Unauthorized"}), 401
 
-
-    
-
 @routes.route('/folders/photos', methods=['GET'])
 def list_photos_in_folder():
-    folder_path = request.args.get('path', '/Photos').rstrip('/')  # Default to '/Photos', strip trailing slash
-
     if 'username' in session:
-        try:
-            # Ensure the folder path is valid
-            if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
-                return jsonify({"error": "Invalid folder path"}), 400
-
-            # Query photos in the folder #must in the folder else would work
-            photos = Photo.query.filter(Photo.folder_path == folder_path).all()
-            current_app.logger.error(f"phto.folder_path: {str(folder_path.split('/')[-1])}")
-            photo_list = [
-                {
-                    "id": photo.id,
-                    "filename": photo.filename,
-                    "thumbnail_url": f"/pic/thumbnail/{os.path.basename(photo.thumbnail_path)}" if photo.thumbnail_path else None,
-                    "photo_url": f"/pic/photos/{photo.filepath.replace('/Photos/', '')}" if photo.filepath else None,
-                    "creation_date": photo.creation_date.isoformat() if photo.creation_date else None,
-                    "camera_model": photo.camera_model,
-                    "focal_length": photo.focal_length,
-                    "lens_model": photo.lens_model,
-                }
-                for photo in photos
-            ]
-            return jsonify({"path": folder_path, "photos": photo_list}), 200
-        except Exception as e:
-            current_app.logger.error(f"Error listing photos in folder {folder_path}: {str(e)}")
-            return jsonify({"error": "Unable to fetch photos", "message": str(e)}), 500
+        return get_folder_photo_list()
     else:
         return jsonify({"message": "Unauthorized"}), 401
 
-
-    
+@routes.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    if 'username' in session:
+        return jsonify(query_cache.stats()), 200
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
 
 @routes.route('/albums', methods=['GET'])
 def list_albums():
     if 'username' in session:
-        albums = Album.query.all()
-        return jsonify([
-            {
-                "id": album.id,
-                "name": album.name,
-                "description": album.description,
-                "creation_date": album.creation_date.isoformat(),
-                "photo_count": len(album.photos),  # Count photos in the album
-                "thumbnail_url": (
-                    f"/pic/thumbnail/{album.photos[0].thumbnail_path.split('/')[-1]}"
-                    if album.photos and album.photos[0].thumbnail_path else None
-                ),  # Address of the first photo's thumbnail or None
-            }
-            for album in albums
-        ])
+        return get_album_list()
     else:
         return jsonify({"message": "Unauthorized"}), 401
     
@@ -210,6 +269,13 @@ def list_photos_in_album():
     else:
         return jsonify({"message": "Unauthorized"}), 401
 
+@routes.route('/album/photos/batch', methods=['POST'])
+def batch_photos_in_album():
+    if 'username' in session:
+        return update_album_photos()
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
+
 @routes.route('/album/action', methods=['GET'])
 def action_in_album():
     if 'username' in session:
@@ -232,6 +298,27 @@ def add_delete_phto_in_album():
     else:
         return jsonify({"message": "Unauthorized"}), 401
 
+@routes.route('/photo/search', methods=['GET'])
+def photo_search():
+    if 'username' in session:
+        return search_photos()
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
+
+@routes.route('/photo/timeline', methods=['GET'])
+def photo_timeline():
+    if 'username' in session:
+        return get_timeline()
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
+
+@routes.route('/photo/timeline/jump', methods=['GET'])
+def photo_timeline_jump():
+    if 'username' in session:
+        return get_timeline_jump()
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
+
 @routes.route('/photoexif', methods=['GET'])
 def get_photo_exif():
     if 'username' in session:
@@ -243,3 +330,14 @@ def get_photo_exif():
             return jsonify({"message": "An error occurred in /photoexif", "error": str(e)}), 500
     else:
         return jsonify({"message": "Unauthorized"}), 401
+
+@routes.route('/photo/geo', methods=['GET'])
+def photo_geo():
+    """
+    Map clusters (or single photos when zoomed in) inside a viewport.
+    Takes bbox=west,south,east,north and zoom.
+    """
+    if 'username' in session:
+        return get_geo_clusters()
+    else:
+        return jsonify({"message": "Unauthorized"}), 401
@@ -0,0 +1,70 @@
+from app.db import db, Photo, AlbumPhoto, TimelineCount
+from datetime import datetime, timedelta
+
+# Rollup dimensions: name -> (value column or None for all photos, join for columns of another table)
+TIMELINE_DIMENSIONS = {
+    'all': (None, None),
+    'folder': (Photo.folder_path, None),
+    'camera': (Photo.camera_model, None),
+    'album': (AlbumPhoto.album_id, (AlbumPhoto, AlbumPhoto.photo_id == Photo.id)),
+}
+
+DAY_CHUNK = 100  # Days refreshed per statement
+
+def day_range(day):
+    start = datetime.combine(day, datetime.min.time())
+    return db.and_(Photo.creation_date >= start, Photo.creation_date < start + timedelta(days=1))
+
+def rollup_select(name, *conditions):
+    """SELECT of (day, dimension, value, count) rows of one dimension."""
+    column, join = TIMELINE_DIMENSIONS[name]
+    day = db.func.date(Photo.creation_date)
+    value = db.literal('') if column is None else db.cast(column, db.String)
+    statement = db.select(day, db.literal(name), value, db.func.count(Photo.id)).select_from(Photo)
+    if join is not None:
+        statement = statement.join(*join)
+    conditions = [Photo.creation_date.isnot(None), *conditions]
+    if column is not None:
+        conditions.append(column.isnot(None))
+    return statement.where(*conditions).group_by(day, value)
+
+def insert_rollup(statement):
+    db.session.execute(
+        db.insert(TimelineCount).from_select(["day", "dimension", "value", "photo_count"], statement)
+    )
+
+def refresh_timeline(days=None):
+    """Recount the given days (datetime.date values) in every dimension, or rebuild the whole rollup.
+
+    The indexer passes the days of the photos it added, changed, moved or removed, so a
+    run only touches those days; each chunk of days is one DELETE and one INSERT ... SELECT
+    per dimension over index ranges of creation_date.
+    """
+    if days is None:
+        db.session.execute(db.delete(TimelineCount))
+        for name in TIMELINE_DIMENSIONS:
+            insert_rollup(rollup_select(name))
+        db.session.commit()
+        return
+
+    days = sorted(set(days))
+    for start in range(0, len(days), DAY_CHUNK):
+        chunk = days[start:start + DAY_CHUNK]
+        db.session.execute(db.delete(TimelineCount).where(TimelineCount.day.in_(chunk)))
+        in_days = db.or_(*(day_range(day) for day in chunk))
+        for name in TIMELINE_DIMENSIONS:
+            insert_rollup(rollup_select(name, in_days))
+    db.session.commit()
+
+def refresh_timeline_album(album_id):
+    """Recount the days of one album after its membership changed; the commit is left to the caller."""
+    db.session.execute(db.delete(TimelineCount).where(
+        TimelineCount.dimension == 'album', TimelineCount.value == str(album_id)
+    ))
+    insert_rollup(rollup_select('album', AlbumPhoto.album_id == album_id))
+
+def day_counts(dimension='all', value=''):
+    """(day, count) rows of the rollup in date order."""
+    return db.session.query(TimelineCount.day, TimelineCount.photo_count).filter(
+        TimelineCount.dimension == dimension, TimelineCount.value == str(value)
+    ).order_by(TimelineCount.day).all()
@@ -0,0 +1,278 @@
+import os
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+import threading
+from app.indexer import PhotoIndexer
+from app.jobs import index_lock
+
+# inotify(7) event bits
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+# File systems where inotify never sees changes made by other hosts
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', '9p', 'afs', 'ceph', 'glusterfs'}
+
+def is_network_mount(path):
+    """True when path lives on a network file system, according to /proc/mounts."""
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    try:
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                mount_point = fields[1].replace('\\040', ' ')
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > len(best):
+                    best, fstype = mount_point, fields[2]
+    except OSError:
+        return False
+    return fstype in NETWORK_FILESYSTEMS
+
+class Inotify:
+    """Minimal ctypes binding of Linux inotify with recursive directory watches."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.paths = {}  # wd -> directory path
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch({path}): {os.strerror(err)}")
+        self.paths[wd] = path
+
+    def add_tree(self, top, skip=None):
+        for root, dirs, _ in os.walk(top):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != skip]
+            try:
+                self.add_watch(root)
+            except OSError as e:
+                if e.errno == errno.ENOSPC:
+                    raise  # out of watches, the caller falls back to polling
+                logging.warning(str(e))
+
+    def remove_tree(self, top):
+        for wd, path in list(self.paths.items()):
+            if path == top or path.startswith(top + '/'):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.paths[wd]
+
+    def rename_tree(self, old, new):
+        for wd, path in list(self.paths.items()):
+            if path == old or path.startswith(old + '/'):
+                self.paths[wd] = new + path[len(old):]
+
+    def read(self, timeout):
+        """Yield (directory, name, mask, cookie) for the events available within timeout seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='surrogateescape')
+            offset += length
+            yield self.paths.get(wd), name, mask, cookie
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+
+    def close(self):
+        os.close(self.fd)
+
+class PhotoWatcher:
+    """Feed file system changes under the photo directory into PhotoIndexer.index_changes.
+
+    Events are coalesced per path and flushed once no new event arrived for
+    `debounce` seconds (or at the latest after `max_delay`), so a camera sync of
+    hundreds of files becomes one small incremental index run.
+    """
+
+    def __init__(self, app, mode='auto', photo_dir="/Photos", thumbnail_dir="/Photos/thumbnail",
+                 debounce=2.0, max_delay=30.0, poll_interval=30.0):
+        self.app = app
+        self.mode = mode
+        self.photo_dir = photo_dir.rstrip('/')
+        self.thumbnail_dir = thumbnail_dir.rstrip('/')
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+
+        # (kind, path) -> time first seen; kind is 'path' (file or tree) or 'folder' (one directory)
+        self.pending = {}
+        self.last_event = 0.0
+        self.cond = threading.Condition()
+        self.stopped = threading.Event()
+
+    def start(self):
+        mode = self.mode
+        if mode == 'auto':
+            mode = 'poll' if is_network_mount(self.photo_dir) else 'inotify'
+        source = self.run_inotify if mode == 'inotify' else self.run_poll
+        threading.Thread(target=source, name='photo-watcher', daemon=True).start()
+        threading.Thread(target=self.run_flusher, name='photo-watcher-flush', daemon=True).start()
+        logging.info(f"Watching {self.photo_dir} for changes ({mode})")
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def is_ignored(self, path):
+        return path == self.thumbnail_dir or path.startswith(self.thumbnail_dir + '/')
+
+    def enqueue(self, path, kind='path'):
+        if self.is_ignored(path):
+            return
+        with self.cond:
+            now = time.monotonic()
+            self.pending.setdefault((kind, path), now)
+            self.last_event = now
+            self.cond.notify()
+
+    def run_inotify(self):
+        try:
+            inotify = Inotify()
+            inotify.add_tree(self.photo_dir, skip=self.thumbnail_dir)
+        except (OSError, AttributeError) as e:
+            logging.warning(f"inotify unavailable ({e}), falling back to polling")
+            return self.run_poll()
+
+        try:
+            while not self.stopped.is_set():
+                moved_dirs = {}  # cookie -> old path of a directory moved away
+                for directory, name, mask, cookie in inotify.read(timeout=1.0):
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were lost, so only a rescan of everything is reliable
+                        self.enqueue(self.photo_dir)
+                        continue
+                    if directory is None or not name:
+                        continue
+                    path = os.path.join(directory, name)
+                    if self.is_ignored(path):
+                        continue
+
+                    if mask & IN_ISDIR:
+                        if mask & IN_MOVED_FROM:
+                            moved_dirs[cookie] = path
+                        elif mask & IN_MOVED_TO and cookie in moved_dirs:
+                            inotify.rename_tree(moved_dirs.pop(cookie), path)
+                        elif mask & (IN_CREATE | IN_MOVED_TO):
+                            # Files may already be in the new tree before its watch exists
+                            inotify.add_tree(path, skip=self.thumbnail_dir)
+                    elif mask & IN_CREATE:
+                        continue  # wait for IN_CLOSE_WRITE, the file is still being written
+                    self.enqueue(path)
+
+                # Directories moved out of the library: stop watching them
+                for old_path in moved_dirs.values():
+                    inotify.remove_tree(old_path)
+        except OSError as e:
+            logging.error(f"inotify watcher stopped ({e}), falling back to polling")
+            inotify.close()
+            return self.run_poll()
+        inotify.close()
+
+    def run_poll(self):
+        """Poll directory mtimes; adding, removing or renaming entries bumps the parent's mtime.
+
+        Only directories are listed, files are stat'ed just in folders that changed.
+        In-place edits that keep the name do not touch the directory, a rescan picks those up.
+        """
+        snapshot = self.snapshot_dirs()
+        while not self.stopped.wait(self.poll_interval):
+            current = self.snapshot_dirs()
+            for path, mtime in current.items():
+                if snapshot.get(path) != mtime:
+                    self.enqueue(path, kind='folder')
+            for path in snapshot.keys() - current.keys():
+                self.enqueue(path)
+            snapshot = current
+
+    def snapshot_dirs(self):
+        mtimes = {}
+        for root, dirs, _ in os.walk(self.photo_dir):
+            dirs[:] = [d for d in dirs if os.path.join(root, d) != self.thumbnail_dir]
+            try:
+                mtimes[root] = os.stat(root).st_mtime_ns
+            except OSError:
+                pass
+        return mtimes
+
+    def take_batch(self):
+        """Wait until the queue has been quiet for `debounce` seconds, then take everything in it."""
+        with self.cond:
+            while not self.stopped.is_set():
+                if self.pending:
+                    now = time.monotonic()
+                    quiet_at = self.last_event + self.debounce
+                    deadline = min(self.pending.values()) + self.max_delay
+                    if now >= quiet_at or now >= deadline:
+                        batch, self.pending = self.pending, {}
+                        return batch
+                    self.cond.wait(min(quiet_at, deadline) - now)
+                else:
+                    self.cond.wait()
+        return {}
+
+    def run_flusher(self):
+        while not self.stopped.is_set():
+            batch = self.take_batch()
+            if not batch:
+                continue
+            paths = [path for kind, path in batch if kind == 'path']
+            folders = [path for kind, path in batch if kind == 'folder']
+            with self.app.app_context(), index_lock() as acquired:
+                if not acquired:
+                    # A full index job is running; keep the events and retry later
+                    with self.cond:
+                        for key, seen_at in batch.items():
+                            self.pending.setdefault(key, seen_at)
+                    self.stopped.wait(self.debounce)
+                    continue
+                try:
+                    indexer = PhotoIndexer(
+                        workers=self.app.config.get('INDEX_WORKERS'),
+                        batch_size=self.app.config.get('INDEX_BATCH_SIZE'),
+                    )
+                    indexer.index_changes(paths, folders)
+                    logging.info(f"Watcher indexed {len(paths)} paths and {len(folders)} folders")
+                except Exception as e:
+                    logging.error(f"Watcher failed to index changes: {str(e)}")
+
+def start_watcher(app):
+    """Start the watcher configured by PHOTO_WATCH (off, auto, inotify or poll)."""
+    mode = app.config.get('PHOTO_WATCH', 'off')
+    if mode == 'off':
+        return None
+    return PhotoWatcher(
+        app,
+        mode=mode,
+        debounce=app.config.get('PHOTO_WATCH_DEBOUNCE', 2.0),
+        poll_interval=app.config.get('PHOTO_WATCH_POLL_INTERVAL', 30.0),
+    ).start()
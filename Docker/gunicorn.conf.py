@@ -0,0 +1,16 @@
+import os
+
+# Production server of the image: gunicorn sends image files with sendfile through
+# wsgi.file_wrapper, which the development server of `python run.py` does not.
+bind = f"0.0.0.0:{os.getenv('PORT', '15381')}"
+
+# One process: the indexing lock, the watcher and the session key live in it.
+# Requests are served by its threads, while image bytes go out through sendfile.
+workers = 1
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 8))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))  # Seconds; large on-demand renders take a while
+
+def post_worker_init(worker):
+    from app.watcher import start_watcher
+    start_watcher(worker.wsgi)
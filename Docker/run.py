@@ -2,6 +2,8 @@ from flask import Flask
 from flask_session import Session
 from app.route import routes  # Import the Blueprint
 from app.db import db
+from app.migrations import migrate
+from app.watcher import start_watcher
 from flask_sqlalchemy import SQLAlchemy
 import os
 import secrets
@@ -14,17 +16,26 @@ app.config['SECRET_KEY'] = secrets.token_hex(16)
 database_uri = os.getenv('DATABASE_URI', 'sqlite:///default.db')  # Fallback to SQLite if not set
 app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['INDEX_WORKERS'] = int(os.getenv('INDEX_WORKERS', os.cpu_count() or 1))  # Indexer processes, defaults to the CPU count
+app.config['INDEX_BATCH_SIZE'] = int(os.getenv('INDEX_BATCH_SIZE', 500))  # Rows per bulk insert and per commit
+# Optional file system watcher: off, auto (inotify, or polling on network mounts), inotify or poll
+app.config['PHOTO_WATCH'] = os.getenv('PHOTO_WATCH', 'off').lower()
+app.config['PHOTO_WATCH_DEBOUNCE'] = float(os.getenv('PHOTO_WATCH_DEBOUNCE', 2.0))  # Seconds of quiet before indexing
+app.config['PHOTO_WATCH_POLL_INTERVAL'] = float(os.getenv('PHOTO_WATCH_POLL_INTERVAL', 30.0))
 Session(app)
 db.init_app(app)
 
 #@app.before_first_request
 def create_tables():
-    """Create tables if they do not exist."""
+    """Create tables if they do not exist and apply pending schema migrations."""
     with app.app_context():
-        db.create_all()
+        migrate()
 
 # Register the Blueprint
 app.register_blueprint(routes)
+create_tables()
 
+# Development server; the image runs `gunicorn -c gunicorn.conf.py run:app`, which starts the watcher itself
 if __name__ == '__main__':
+    start_watcher(app)
     app.run(host='0.0.0.0', port=15381)